@@ -1,59 +1,334 @@
+import hmac
+import json
+import os
+import random
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
 
 BASE_URL = "https://api.bannerbear.com/v2"
+SYNC_BASE_URL = "https://sync.api.bannerbear.com/v2"
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+MAX_CATALOG_WORKERS = 8
+
+# Render polling: a fast first check, then exponential backoff with jitter up to an overall deadline.
+POLL_INITIAL_DELAY = 0.3
+POLL_MAX_DELAY = 3.0
+POLL_BACKOFF = 1.6
+RENDER_DEADLINE_SECONDS = float(os.getenv("BANNERBEAR_RENDER_DEADLINE_SECONDS", "90"))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Creating a render is not idempotent, so only retry responses that guarantee nothing was created.
+RETRYABLE_CREATE_STATUS_CODES = {429, 503}
+MAX_HTTP_RETRIES = 3
+
+# Optional faster completion paths. The sync endpoint holds the request open until the render
+# finishes (Bannerbear answers 408 after ~10 s); the webhook lets Bannerbear push the result.
+USE_SYNC_ENDPOINT = os.getenv("BANNERBEAR_SYNC", "").lower() in ("1", "true", "yes")
+WEBHOOK_URL = os.getenv("BANNERBEAR_WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("BANNERBEAR_WEBHOOK_SECRET")
+MAX_PENDING_WEBHOOK_RESULTS = 1000
+CANCEL_CHECK_SECONDS = 0.25  # how often a webhook wait checks whether its render was cancelled
+# Optional client-side cap on render create/poll requests per second (Bannerbear rate-limits per API key).
+RATE_LIMIT_PER_SECOND = float(os.getenv("BANNERBEAR_RATE_LIMIT", "0"))
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Returns the process-wide keep-alive session shared by every Bannerbear call."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=MAX_CATALOG_WORKERS * 2)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+class RateLimiter:
+    """Token bucket shared by all threads: `acquire` blocks until a request may be sent."""
+
+    def __init__(self, per_second: float, burst: int = None):
+        self.per_second = per_second
+        self.capacity = burst or max(1, int(per_second))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_second)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.per_second
+            time.sleep(wait)
+
+_rate_limiter = RateLimiter(RATE_LIMIT_PER_SECOND) if RATE_LIMIT_PER_SECOND > 0 else None
+
+def set_rate_limit(per_second: float):
+    """Caps render create/poll requests to `per_second` for the whole process (0 disables the cap)."""
+    global _rate_limiter
+    _rate_limiter = RateLimiter(per_second) if per_second > 0 else None
+
+def _headers(api_key: str):
+    return {"Authorization": f"Bearer {api_key}"}
 
 def list_templates(api_key: str):
-    headers = {"Authorization": f"Bearer {api_key}"}
     try:
-        response = requests.get(f"{BASE_URL}/templates", headers=headers)
+        response = get_session().get(f"{BASE_URL}/templates", headers=_headers(api_key), timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"API Error fetching templates: {e}")
         return None
 
+def fetch_template_summaries(api_key: str, etag: str = None):
+    """
+    Conditional version of list_templates for revalidation.
+    Returns (summaries, etag). summaries is None if the list is unchanged since `etag` (HTTP 304) or the request failed.
+    """
+    headers = _headers(api_key)
+    if etag:
+        headers["If-None-Match"] = etag
+    try:
+        response = get_session().get(f"{BASE_URL}/templates", headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json(), response.headers.get("ETag")
+    except requests.exceptions.RequestException as e:
+        print(f"API Error fetching templates: {e}")
+        return None, etag
+
 def get_template_details(api_key: str, template_uid: str):
-    headers = {"Authorization": f"Bearer {api_key}"}
     try:
-        response = requests.get(f"{BASE_URL}/templates/{template_uid}", headers=headers)
+        response = get_session().get(f"{BASE_URL}/templates/{template_uid}", headers=_headers(api_key), timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"API Error fetching template details for {template_uid}: {e}")
         return None
 
-def create_image(api_key: str, template_id: str, modifications: list):
-    headers = {"Authorization": f"Bearer {api_key}"}
+def fetch_template_details(api_key: str, template_uids: list, max_workers: int = MAX_CATALOG_WORKERS):
+    """
+    Fetches details for many templates concurrently over the shared session.
+    Returns a dict of uid -> details, in input order. Templates that fail to load are left out.
+    """
+    if not template_uids:
+        return {}
+    workers = max(1, min(max_workers, len(template_uids)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bb-template") as pool:
+        results = pool.map(lambda uid: get_template_details(api_key, uid), template_uids)
+        return {uid: details for uid, details in zip(template_uids, results) if details}
+
+def load_template_catalog(api_key: str, max_workers: int = MAX_CATALOG_WORKERS):
+    """
+    Lists every template and loads their full details in parallel.
+    Returns (templates, elapsed_seconds); templates is None if the summary list itself could not be fetched.
+    """
+    start = time.perf_counter()
+    summary = list_templates(api_key)
+    if summary is None:
+        return None, time.perf_counter() - start
+
+    template_uids = [t['uid'] for t in summary if t and t.get('uid')]
+    details = fetch_template_details(api_key, template_uids, max_workers)
+    elapsed = time.perf_counter() - start
+
+    failed = len(template_uids) - len(details)
+    print(f"Loaded {len(details)}/{len(template_uids)} templates in {elapsed:.2f}s" + (f" ({failed} failed)" if failed else ""))
+    return list(details.values()), elapsed
+
+def _request_with_retry(method: str, url: str, api_key: str, retry_statuses: set = RETRYABLE_STATUS_CODES, **kwargs):
+    """Sends a request over the shared session, retrying 429/5xx responses with backoff (honouring Retry-After)."""
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    for attempt in range(MAX_HTTP_RETRIES + 1):
+        if _rate_limiter is not None:
+            _rate_limiter.acquire()
+        response = get_session().request(method, url, headers=_headers(api_key), **kwargs)
+        if response.status_code not in retry_statuses or attempt == MAX_HTTP_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else POLL_INITIAL_DELAY * (2 ** attempt)
+        time.sleep(min(delay, POLL_MAX_DELAY * 4) + random.uniform(0, 0.25))
+    return response
+
+def create_image(api_key: str, template_id: str, modifications: list, synchronous: bool = USE_SYNC_ENDPOINT, webhook_url: str = WEBHOOK_URL):
+    """
+    Starts a render. With synchronous=True the sync endpoint is tried first and usually returns an
+    already completed image object; if it times out, the pending object is returned for polling.
+    """
     payload = {
         "template": template_id,
         "modifications": modifications
     }
+    if webhook_url:
+        payload["webhook_url"] = webhook_url
     try:
-        response = requests.post(f"{BASE_URL}/images", headers=headers, json=payload)
+        if synchronous:
+            response = _request_with_retry("POST", f"{SYNC_BASE_URL}/images", api_key, RETRYABLE_CREATE_STATUS_CODES, json=payload, timeout=(5, 15))
+            if response.status_code == 408:
+                image_object = response.json() if response.content else {}
+                if image_object.get("uid"):
+                    image_object.setdefault("self", f"{BASE_URL}/images/{image_object['uid']}")
+                    image_object.setdefault("status", "pending")
+                    return image_object
+                print("Sync render timed out without an image object; falling back to the async endpoint.")
+            else:
+                response.raise_for_status()
+                return response.json()
+
+        response = _request_with_retry("POST", f"{BASE_URL}/images", api_key, RETRYABLE_CREATE_STATUS_CODES, json=payload)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"API Error creating image: {e}")
         return None
 
-def poll_for_image(api_key: str, image_object: dict):
-    headers = {"Authorization": f"Bearer {api_key}"}
+def get_template_set(api_key: str, template_set_uid: str):
+    """A template set with its templates' full details, or None."""
+    try:
+        response = get_session().get(f"{BASE_URL}/template_sets/{template_set_uid}", headers=_headers(api_key), timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"API Error fetching template set {template_set_uid}: {e}")
+        return None
+
+def create_collection(api_key: str, template_set_uid: str, modifications: list, webhook_url: str = WEBHOOK_URL, metadata: str = None):
+    """
+    Starts a collection: one request that renders the same modifications on every template of a
+    template set. Poll it with `poll_for_image`; the completed object maps template uid -> URL in `image_urls`.
+    """
+    payload = {"template_set": template_set_uid, "modifications": modifications}
+    if webhook_url:
+        payload["webhook_url"] = webhook_url
+    if metadata:
+        payload["metadata"] = metadata
+    try:
+        response = _request_with_retry("POST", f"{BASE_URL}/collections", api_key, RETRYABLE_CREATE_STATUS_CODES, json=payload)
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"API Error creating collection: {e}")
+        return None
+
+def poll_for_image(api_key: str, image_object: dict, deadline_seconds: float = RENDER_DEADLINE_SECONDS,
+                   cancel_event: threading.Event = None, on_poll=None):
+    """
+    Waits for a render (an image or a collection) to finish. Returns the completed image object, None if the render failed,
+    or the last known object with status "timed_out" once `deadline_seconds` have passed
+    ("cancelled" if `cancel_event` is set first). `on_poll(seconds, status, source)` is called after each status check.
+    """
+    if image_object.get('status') == 'completed':
+        return image_object
     polling_url = image_object.get("self")
     if not polling_url:
         return None
 
+    deadline = time.monotonic() + deadline_seconds
+    delay = POLL_INITIAL_DELAY
     while image_object['status'] != 'completed':
-        time.sleep(1)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"Image generation timed out after {deadline_seconds:.0f}s.")
+            return {**image_object, "status": "timed_out"}
+
+        pushed = _wait_for_webhook(image_object.get("uid"), min(delay + random.uniform(0, delay * 0.25), remaining), cancel_event)
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+        if cancel_event is not None and cancel_event.is_set():
+            return {**image_object, "status": "cancelled"}
         try:
-            response = requests.get(polling_url, headers=headers)
-            response.raise_for_status()
-            image_object = response.json()
+            poll_start = time.perf_counter()
+            if pushed:
+                image_object = pushed
+            else:
+                response = _request_with_retry("GET", polling_url, api_key)
+                response.raise_for_status()
+                image_object = response.json()
+            if on_poll:
+                on_poll(time.perf_counter() - poll_start, image_object.get('status'), "webhook" if pushed else "poll")
             if image_object['status'] == 'failed':
                 print("Image generation failed.")
                 return None
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"API Error polling for image: {e}")
             return None
-    
-    return image_object
\ No newline at end of file
+
+    return image_object
+
+_webhook_results = {}  # image uid -> image object pushed by Bannerbear
+_webhook_condition = threading.Condition()
+_webhook_server = None
+
+def record_webhook_image(image_object: dict):
+    """Stores an image object delivered by a Bannerbear webhook and wakes any poller waiting on it."""
+    uid = image_object.get("uid")
+    if not uid:
+        return
+    with _webhook_condition:
+        _webhook_results[uid] = image_object
+        while len(_webhook_results) > MAX_PENDING_WEBHOOK_RESULTS:
+            _webhook_results.pop(next(iter(_webhook_results)))
+        _webhook_condition.notify_all()
+
+def _wait_for_webhook(image_uid: str, timeout: float, cancel_event: threading.Event = None):
+    """Sleeps up to `timeout` seconds, returning early with the pushed image object if its webhook arrives."""
+    if _webhook_server is None or not image_uid:
+        if cancel_event is not None:
+            cancel_event.wait(timeout)
+        else:
+            time.sleep(timeout)
+        return None
+    deadline = time.monotonic() + timeout
+    with _webhook_condition:
+        # Waits in short slices so a cancelled (superseded) render frees its worker promptly.
+        while image_uid not in _webhook_results:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancel_event is not None and cancel_event.is_set()):
+                return None
+            _webhook_condition.wait(min(remaining, CANCEL_CHECK_SECONDS))
+        return _webhook_results.pop(image_uid)
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {WEBHOOK_SECRET}"):
+            self.send_response(401)
+            self.end_headers()
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            record_webhook_image(json.loads(body))
+            self.send_response(200)
+        except ValueError:
+            self.send_response(400)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_webhook_listener(port: int):
+    """
+    Starts a background HTTP listener for Bannerbear render webhooks. BANNERBEAR_WEBHOOK_URL must
+    route to this port; while it runs, pollers are woken as soon as a render's webhook arrives.
+    Refuses to start (returns None, renders are polled) without BANNERBEAR_WEBHOOK_SECRET, since an
+    unauthenticated listener would accept forged "completed" renders from anyone.
+    """
+    global _webhook_server
+    if not WEBHOOK_SECRET:
+        print("Not starting the Bannerbear webhook listener: BANNERBEAR_WEBHOOK_SECRET is not set. Renders will be polled.")
+        return None
+    if _webhook_server is None:
+        _webhook_server = ThreadingHTTPServer(("0.0.0.0", port), _WebhookHandler)
+        threading.Thread(target=_webhook_server.serve_forever, name="bb-webhook", daemon=True).start()
+        print(f"Listening for Bannerbear webhooks on port {port}")
+    return _webhook_server
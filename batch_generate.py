@@ -0,0 +1,308 @@
+"""
+Headless batch mode: renders a flyer for every listing in a CSV or JSONL feed, without the chat UI.
+
+    python batch_generate.py listings.csv --template <uid> --mapping mapping.json
+    python batch_generate.py listings.jsonl --template-set <uid> --concurrency 4
+    python batch_generate.py listings.csv --ai
+
+The mapping is a JSON object of layer name -> format string over the listing's fields, e.g.
+{"address": "{street}, {city}", "price": "{list_price!m}", "property_photo": "{photo_url}"}
+(`!m` formats a number as a price, "$950,000"). Without a mapping, fields are matched to layers of
+the same name. With --ai, Gemini picks the template (unless one is given) and fills the layers,
+exactly as it would in the chat.
+
+Progress is appended to a JSONL manifest, one record per state change (the last one per listing
+wins). Re-running with the same manifest skips completed listings and resumes polling renders that
+were already submitted, so a crash costs no extra Bannerbear credits.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import bannerbear_helpers
+from bannerbear_helpers import create_collection, create_image, get_template_set, poll_for_image
+from design_flow import DesignServices, handle_ai_decision, new_session_state
+from template_index import TemplateDigest, TemplateRetrievalIndex, modifiable_layers, normalize_layer_name, select_prompt_templates
+from template_store import TemplateStore
+
+DEFAULT_AI_PROMPT = "Make a Just Listed flyer for this new listing. Use every detail that fits the template."
+
+def read_listings(path: Path):
+    """Listings from a CSV file (with a header row) or a JSONL file, as a list of dicts."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+def listing_key(listing: dict, id_field: str):
+    """A stable ID for a listing: its `id_field` value, or a hash of its contents."""
+    value = listing.get(id_field)
+    if value not in (None, ""):
+        return str(value)
+    return hashlib.sha1(json.dumps(listing, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+def format_price(value):
+    try:
+        return f"${float(str(value).replace('$', '').replace(',', '')):,.0f}"
+    except ValueError:
+        return str(value)
+
+class _ListingFormatter(string.Formatter):
+    """str.format over a listing where missing or empty fields render as "" and `!m` formats prices."""
+
+    def get_value(self, key, args, kwargs):
+        value = kwargs.get(key)
+        return "" if value is None else value
+
+    def convert_field(self, value, conversion):
+        if conversion == "m":
+            return format_price(value) if value != "" else ""
+        return super().convert_field(value, conversion)
+
+_formatter = _ListingFormatter()
+
+def auto_mapping(layers: dict, fields):
+    """Maps each layer to the listing field with the same normalised name, e.g. "agent_name" <- "Agent Name"."""
+    by_name = {normalize_layer_name(field): field for field in fields}
+    return {layer: f"{{{by_name[normalize_layer_name(layer)]}}}" for layer in layers if normalize_layer_name(layer) in by_name}
+
+def map_listing(listing: dict, mapping: dict, layers: dict):
+    """Builds Bannerbear modifications for a listing, putting each value under the key its layer type takes."""
+    modifications = []
+    for layer, template in mapping.items():
+        if layer not in layers:
+            continue
+        value = _formatter.format(template, **listing).strip()
+        if value:
+            key = "image_url" if layers[layer] == "image" else layers[layer]
+            modifications.append({"name": layer, key: value})
+    return modifications
+
+class Manifest:
+    """
+    Append-only JSONL log of listing states; `records` holds the latest record per listing.
+    A read-only manifest (used by dry runs) keeps new records in memory and never touches the file.
+    """
+
+    def __init__(self, path: Path, read_only: bool = False):
+        self.path = path
+        self.records = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self.records[record["id"]] = record
+        self._file = None if read_only else open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, listing_id: str, status: str, **fields):
+        record = {"id": listing_id, "status": status, "at": round(time.time(), 3), **fields}
+        with self._lock:
+            self.records[listing_id] = record
+            if self._file:
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        return record
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+class AiFiller:
+    """Asks Gemini to choose a template and fill its layers for a listing, through the chat's own prompt and decision handling."""
+
+    def __init__(self, api_key: str, templates: list, prompt: str, template_uid: str = None):
+        from gemini_helpers import get_gemini_model
+        self.model = get_gemini_model(api_key)
+        self.prompt = prompt
+        self.template_uid = template_uid
+        self.digest, self.index = TemplateDigest(), TemplateRetrievalIndex()
+        self.digest.sync(templates)
+        self.index.sync(templates)
+        self.services = DesignServices(templates, self.index, render_cache=None, render_queue=None)
+
+    def fill(self, listing_id: str, listing: dict):
+        """Returns (template_uid, modifications), or (None, reason) if Gemini did not produce a design."""
+        from gemini_helpers import generate_gemini_response, read_gemini_stream
+        state = new_session_state(f"batch-{listing_id}")
+        state["design_context"]["template_uid"] = self.template_uid
+        message = f"{self.prompt}\n{json.dumps(listing, default=str)}"
+        candidate_uids = [self.template_uid] if self.template_uid else select_prompt_templates(self.index, message, state["design_context"])
+        response = generate_gemini_response(self.model, [], message, self.digest.render(candidate_uids), state["design_context"], stream=True)
+        kind, payload = read_gemini_stream(response) if response else (None, None)
+        if kind != "function_call" or payload.get("action") != "MODIFY":
+            return None, (payload if kind == "text" else (payload or {}).get("response_text")) or "Gemini did not fill a template."
+        if self.template_uid:
+            payload["template_uid"] = self.template_uid
+        handle_ai_decision(payload, state, self.services)
+        context = state["design_context"]
+        return context["template_uid"], context["modifications"]
+
+def render_listing(args, manifest: Manifest, listing_id: str, listing: dict, plan):
+    """Renders one listing (or resumes its submitted render) and records the outcome. Returns the final record."""
+    start = time.perf_counter()
+    previous = manifest.records.get(listing_id)
+    if previous and previous["status"] == "submitted" and previous.get("poll_url"):
+        if args.dry_run:
+            return manifest.record(listing_id, "would_resume", template_uid=previous.get("template_uid"), poll_url=previous["poll_url"])
+        render = {"uid": previous.get("render_uid"), "self": previous["poll_url"], "status": "pending"}
+        target = previous.get("template_uid")
+    else:
+        if args.ai:
+            target, modifications = plan.fill(listing_id, listing)
+            if target is None:
+                return manifest.record(listing_id, "failed", error=modifications)
+        else:
+            target, modifications = args.template_set or args.template, map_listing(listing, plan["mapping"], plan["layers"])
+        if not modifications:
+            return manifest.record(listing_id, "failed", error="No listing fields mapped to template layers.")
+        if args.dry_run:
+            return manifest.record(listing_id, "planned", template_uid=target, modifications=modifications)
+
+        if args.template_set:
+            render = create_collection(args.bb_api_key, target, modifications, metadata=listing_id)
+        else:
+            render = create_image(args.bb_api_key, target, modifications)
+        if not render:
+            return manifest.record(listing_id, "failed", template_uid=target, error="Failed to start rendering.")
+        manifest.record(listing_id, "submitted", template_uid=target, render_uid=render.get("uid"), poll_url=render.get("self"))
+
+    final = poll_for_image(args.bb_api_key, render, deadline_seconds=args.render_deadline)
+    seconds = round(time.perf_counter() - start, 3)
+    if final and final.get("status") == "completed":
+        urls = final.get("image_urls") if args.template_set else final.get("image_url_png") or final.get("image_url")
+        return manifest.record(listing_id, "completed", template_uid=target, image_url=urls, seconds=seconds)
+    if final and final.get("status") == "timed_out":
+        # Keep it "submitted" so the next run resumes polling instead of rendering again.
+        return manifest.record(listing_id, "submitted", template_uid=target, render_uid=render.get("uid"), poll_url=render.get("self"), seconds=seconds)
+    return manifest.record(listing_id, "failed", template_uid=target, error="Rendering failed.", seconds=seconds)
+
+def prepare_plan(args, listings: list):
+    """
+    Loads what every listing needs: Gemini and the catalog for --ai, otherwise the target's layers and
+    the mapping. Templates come from the same disk-backed TemplateStore as the app (a single --template
+    is read without loading or revalidating the whole catalog); template sets are always fetched.
+    """
+    if args.ai:
+        templates = TemplateStore(args.bb_api_key).templates()
+        if not templates:
+            raise SystemExit("Could not load the Bannerbear template catalog.")
+        return AiFiller(args.gemini_api_key, templates, args.ai_prompt, args.template)
+
+    if args.template_set:
+        template_set = get_template_set(args.bb_api_key, args.template_set)
+        templates = template_set.get("templates", []) if template_set else None
+    else:
+        template = TemplateStore(args.bb_api_key, autoload=False).get(args.template)
+        templates = [template] if template else None
+    if not templates:
+        raise SystemExit(f"Could not load {'template set' if args.template_set else 'template'} {args.template_set or args.template}.")
+    layers = {}
+    for template in templates:
+        layers.update(modifiable_layers(template))
+
+    fields = {field for listing in listings for field in listing}
+    mapping = json.loads(args.mapping.read_text(encoding="utf-8")) if args.mapping else auto_mapping(layers, fields)
+    unknown = sorted(set(mapping) - set(layers))
+    if unknown:
+        print(f"Ignoring mapped layers the template does not have: {', '.join(unknown)}")
+    if not set(mapping) & set(layers):
+        raise SystemExit(f"No listing fields map to the template's layers ({', '.join(layers)}). Pass --mapping.")
+    return {"mapping": mapping, "layers": layers}
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render flyers for a CSV/JSONL feed of listings through Bannerbear.")
+    parser.add_argument("listings", type=Path, help="CSV (with a header row) or JSONL file of listings.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--template", help="Bannerbear template UID to render every listing on.")
+    target.add_argument("--template-set", help="Bannerbear template set UID; each listing is rendered on all of its templates as one collection.")
+    parser.add_argument("--mapping", type=Path, help="JSON file of layer name -> format string over listing fields.")
+    parser.add_argument("--ai", action="store_true", help="Let Gemini choose the template (unless --template is given) and fill its layers.")
+    parser.add_argument("--ai-prompt", default=DEFAULT_AI_PROMPT, help="Instruction sent to Gemini before each listing.")
+    parser.add_argument("--id-field", default="mls_id", help="Listing field that identifies it across runs (default: mls_id; a content hash otherwise).")
+    parser.add_argument("--manifest", type=Path, help="JSONL manifest to write and resume from (default: <listings>.manifest.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Listings rendered at the same time.")
+    parser.add_argument("--rate-limit", type=float, default=2.5, help="Max Bannerbear render requests per second, polls included (0 = no limit).")
+    parser.add_argument("--render-deadline", type=float, default=bannerbear_helpers.RENDER_DEADLINE_SECONDS, help="Seconds to wait for each render.")
+    parser.add_argument("--retry-failed", action="store_true", help="Also re-render listings the manifest records as failed.")
+    parser.add_argument("--dry-run", action="store_true", help="Show the modifications each pending listing would get, without rendering or writing the manifest.")
+    parser.add_argument("--report", type=Path, help="Also write the throughput report to this JSON file.")
+    args = parser.parse_args()
+    if args.template_set and args.ai:
+        parser.error("--ai cannot be combined with --template-set.")
+    if not (args.template or args.template_set or args.ai):
+        parser.error("Pass --template, --template-set or --ai.")
+    return args
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    args.bb_api_key, args.gemini_api_key = os.getenv("BANNERBEAR_API_KEY"), os.getenv("GEMINI_API_KEY")
+    if not args.bb_api_key or (args.ai and not args.gemini_api_key):
+        raise SystemExit("BANNERBEAR_API_KEY (and GEMINI_API_KEY for --ai) must be set.")
+    bannerbear_helpers.set_rate_limit(args.rate_limit)
+
+    listings = {listing_key(listing, args.id_field): listing for listing in read_listings(args.listings)}
+    manifest = Manifest(args.manifest or args.listings.with_suffix(".manifest.jsonl"), read_only=args.dry_run)
+    done_statuses = {"completed"} if args.retry_failed else {"completed", "failed"}
+    todo = [(key, listing) for key, listing in listings.items() if manifest.records.get(key, {}).get("status") not in done_statuses]
+    print(f"{len(listings)} listings, {len(listings) - len(todo)} already done, {len(todo)} to render -> {manifest.path}"
+          + (" (dry run, not written)" if args.dry_run else ""))
+
+    plan = prepare_plan(args, [listing for _, listing in todo]) if todo else None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="batch") as pool:
+        futures = [pool.submit(render_listing, args, manifest, key, listing, plan) for key, listing in todo]
+        results = []
+        for number, future in enumerate(futures, 1):
+            try:
+                record = future.result()
+            except Exception as e:
+                key = todo[number - 1][0]
+                print(f"Listing {key} crashed: {e}")
+                record = manifest.record(key, "failed", error=str(e))
+            results.append(record)
+            print(f"[{number}/{len(futures)}] {record['id']}: {record['status']}" + (f" ({record['error']})" if record.get("error") else ""))
+            if record["status"] == "planned":
+                print(f"    {record['template_uid']}: {json.dumps(record['modifications'])}")
+    elapsed = time.perf_counter() - start
+    manifest.close()
+
+    statuses = {}
+    for record in results:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    seconds = [record["seconds"] for record in results if record["status"] == "completed"]
+    report = {
+        "listings": len(listings),
+        "attempted": len(todo),
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 2),
+        "listings_per_minute": round(len(todo) / elapsed * 60, 1) if elapsed and todo else 0.0,
+        "render_p50_seconds": round(percentile(seconds, 0.50), 2),
+        "render_p95_seconds": round(percentile(seconds, 0.95), 2),
+        "manifest": str(manifest.path),
+    }
+    print(json.dumps(report, indent=2))
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
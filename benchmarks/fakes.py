@@ -0,0 +1,222 @@
+"""Local stand-ins for Bannerbear, freeimage.host and Gemini with configurable latency and failure rates."""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Named templates the scripted conversations refer to; make_fake_templates pads the catalog with fillers.
+KNOWN_TEMPLATES = [
+    ("tpl-just-sold-flyer", "Just Sold Flyer", {"address": "text", "price": "text", "agent_name": "text", "agent_photo": "image", "property_photo": "image"}),
+    ("tpl-just-sold-modern", "Modern Just Sold Flyer", {"address": "text", "price": "text", "agent_name": "text", "agent_photo": "image", "property_photo": "image"}),
+    ("tpl-just-listed-flyer", "Just Listed Flyer", {"address": "text", "price": "text", "features": "text", "agent_name": "text", "agent_photo": "image", "property_photo": "image"}),
+    ("tpl-open-house", "Open House Announcement", {"address": "text", "date_time": "text", "agent_name": "text", "property_photo": "image"}),
+    ("tpl-business-card", "Agent Business Card", {"agent_name": "text", "phone": "text", "email": "text", "agent_photo": "image"}),
+]
+_FILLER_WORDS = ["Luxury", "Coastal", "Classic", "Bold", "Minimal", "Elegant", "Urban", "Rustic"]
+_FILLER_KINDS = ["Price Reduced Post", "Coming Soon Banner", "Market Update Card", "Holiday Greeting", "Testimonial Post"]
+
+class FakeLatency:
+    """Sleeps for `base_ms` plus up to `jitter_ms`, and fails with probability `failure_rate`."""
+
+    def __init__(self, base_ms: float = 50, jitter_ms: float = 20, failure_rate: float = 0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+
+    def seconds(self):
+        """One random delay, in seconds."""
+        return (self.base_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+    def wait(self):
+        time.sleep(self.seconds())
+
+    def should_fail(self):
+        return random.random() < self.failure_rate
+
+def _template(uid: str, name: str, layers: dict):
+    modifications = []
+    for layer_name, layer_type in layers.items():
+        modification = {"name": layer_name}
+        modification.update({"image_url": None} if layer_type == "image" else {"text": None, "color": None, "background": None})
+        modifications.append(modification)
+    return {
+        "uid": uid, "name": name, "width": 1080, "height": 1350, "updated_at": "2024-01-01T00:00:00Z",
+        "preview_url": f"https://example.invalid/previews/{uid}.png", "available_modifications": modifications,
+    }
+
+def make_fake_templates(count: int):
+    """The scripted templates plus generated fillers, `count` in total (at least the scripted ones)."""
+    templates = [_template(uid, name, layers) for uid, name, layers in KNOWN_TEMPLATES]
+    for n in range(count - len(templates)):
+        name = f"{_FILLER_WORDS[n % len(_FILLER_WORDS)]} {_FILLER_KINDS[n // len(_FILLER_WORDS) % len(_FILLER_KINDS)]}"
+        templates.append(_template(f"tpl-filler-{n}", name, {"headline": "text", "address": "text", "price": "text", "property_photo": "image"}))
+    return templates
+
+class FakeApiServer:
+    """
+    One local HTTP server answering the Bannerbear endpoints the app uses (/v2/templates,
+    /v2/templates/<uid>, /v2/images, /v2/images/<uid>) and the freeimage.host upload endpoint.
+    Renders complete `render_seconds` (plus up to `render_jitter_seconds`) after they are created.
+    """
+
+    def __init__(self, templates: list, latency: FakeLatency, render_seconds: float = 1.0, render_jitter_seconds: float = 0.5,
+                 render_failure_rate: float = 0.0, upload_latency: FakeLatency = None):
+        self.templates = {t["uid"]: t for t in templates}
+        self.latency = latency
+        self.upload_latency = upload_latency or latency
+        self.render_seconds = render_seconds
+        self.render_jitter_seconds = render_jitter_seconds
+        self.render_failure_rate = render_failure_rate
+        self.requests = {"templates": 0, "images_created": 0, "image_polls": 0, "uploads": 0, "injected_failures": 0}
+        self._images = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake._handle(self, "GET")
+
+            def do_POST(self):
+                fake._handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _count(self, key):
+        with self._lock:
+            self.requests[key] += 1
+
+    def _handle(self, handler, method):
+        length = int(handler.headers.get("Content-Length", 0))
+        body = handler.rfile.read(length) if length else b""
+        path = handler.path.split("?")[0]
+        is_upload = path.startswith("/api/1/upload")
+        latency = self.upload_latency if is_upload else self.latency
+        latency.wait()
+        if latency.should_fail():
+            self._count("injected_failures")
+            return self._send(handler, 500, {"message": "injected failure"})
+
+        if is_upload and method == "POST":
+            self._count("uploads")
+            return self._send(handler, 200, {"status_code": 200, "image": {"url": f"{self.base_url}/uploads/{next(self._ids)}.jpg"}})
+        if path == "/v2/templates" and method == "GET":
+            self._count("templates")
+            return self._send(handler, 200, [{"uid": t["uid"], "name": t["name"], "updated_at": t["updated_at"]} for t in self.templates.values()])
+        match = re.fullmatch(r"/v2/templates/([\w-]+)", path)
+        if match and method == "GET":
+            self._count("templates")
+            template = self.templates.get(match.group(1))
+            return self._send(handler, 200, template) if template else self._send(handler, 404, {"message": "not found"})
+        if path == "/v2/images" and method == "POST":
+            self._count("images_created")
+            payload = json.loads(body or b"{}")
+            if payload.get("template") not in self.templates:
+                return self._send(handler, 422, {"message": "unknown template"})
+            uid = f"img-{next(self._ids)}"
+            ready_at = time.time() + self.render_seconds + random.uniform(0, self.render_jitter_seconds)
+            with self._lock:
+                self._images[uid] = (ready_at, random.random() < self.render_failure_rate)
+            return self._send(handler, 202, self._image_object(uid))
+        match = re.fullmatch(r"/v2/images/([\w-]+)", path)
+        if match and method == "GET":
+            self._count("image_polls")
+            if match.group(1) not in self._images:
+                return self._send(handler, 404, {"message": "not found"})
+            return self._send(handler, 200, self._image_object(match.group(1)))
+        return self._send(handler, 404, {"message": "not found"})
+
+    def _image_object(self, uid):
+        ready_at, fails = self._images[uid]
+        status = "pending" if time.time() < ready_at else ("failed" if fails else "completed")
+        image = {"uid": uid, "status": status, "self": f"{self.base_url}/v2/images/{uid}"}
+        if status == "completed":
+            image["image_url_png"] = f"{self.base_url}/renders/{uid}.png"
+        return image
+
+    def _send(self, handler, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+class FakeGeminiModel:
+    """
+    Stands in for `genai.GenerativeModel`. `generate_content` returns the scripted `reply` (a
+    process_user_request argument dict, or a plain string) shaped like the SDK's response objects,
+    after `first_token_ms` and the remaining `latency` for the rest of the stream.
+    """
+
+    def __init__(self, latency: FakeLatency, first_token_ms: float = 300):
+        self.latency = latency
+        self.first_token_ms = first_token_ms
+        self.reply = None
+        self.calls = 0
+
+    def generate_content(self, conversation, stream=False):
+        self.calls += 1
+        if self.latency.should_fail():
+            raise RuntimeError("injected Gemini failure")
+        prompt_chars = sum(len(part) for message in conversation for part in message["parts"])
+        usage = SimpleNamespace(prompt_token_count=prompt_chars // 4, candidates_token_count=40)
+        chunks = self._chunks()
+        if stream:
+            return _FakeStream(chunks, self.first_token_ms, self.latency, usage)
+        self.latency.wait()
+        parts = [part for chunk in chunks for part in chunk.candidates[0].content.parts]
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))], usage_metadata=usage)
+
+    def _chunks(self):
+        def chunk(part):
+            return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+        if isinstance(self.reply, dict):
+            call = SimpleNamespace(name="process_user_request", args=dict(self.reply))
+            return [chunk(SimpleNamespace(function_call=call, text=""))]
+        words = str(self.reply or "").split(" ")
+        return [chunk(SimpleNamespace(function_call=None, text=" ".join(words[i:i + 4]) + " ")) for i in range(0, len(words), 4)]
+
+class _FakeStream:
+    def __init__(self, chunks, first_token_ms, latency, usage):
+        self._chunks = chunks
+        self._first_token_ms = first_token_ms
+        self._latency = latency
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        time.sleep(self._first_token_ms / 1000)
+        generation_seconds = self._latency.seconds()
+        if len(self._chunks) == 1:
+            # A function call arrives as one chunk, once its arguments are fully generated.
+            time.sleep(generation_seconds)
+        for index, chunk in enumerate(self._chunks):
+            if index:
+                time.sleep(generation_seconds / (len(self._chunks) - 1))
+            yield chunk
@@ -0,0 +1,231 @@
+"""
+Offline load test: replays scripted conversations through the app's hot paths against local fakes.
+
+    python -m benchmarks.run_benchmark --conversations 40 --concurrency 8
+
+Each turn goes through the intent router, `generate_gemini_response` + `read_gemini_stream` and
+`design_flow.handle_ai_decision`, then waits for any queued renders, exactly as a chat session would.
+No real Bannerbear credits, freeimage.host uploads or Gemini quota are used.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+import bannerbear_helpers
+import image_uploader
+import telemetry
+from benchmarks.fakes import FakeApiServer, FakeGeminiModel, FakeLatency, make_fake_templates
+from conversation_memory import ConversationMemory
+from design_flow import DesignServices, handle_ai_decision, new_session_state
+from gemini_helpers import generate_gemini_response, read_gemini_stream
+from intent_router import route_message, router_stats
+from render_cache import RenderCache
+from render_queue import RenderQueue
+from template_index import TemplateDigest, TemplateRetrievalIndex, select_prompt_templates
+
+DEFAULT_SCRIPT = Path(__file__).parent / "conversations.json"
+RENDER_WAIT_POLL_SECONDS = 0.02
+
+class LatencyRecorder:
+    """Collects every sample per stage (the harness needs exact p99s, unlike the app's rolling window)."""
+
+    def __init__(self):
+        self.samples = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def fail(self, stage: str):
+        with self._lock:
+            self.failures[stage] = self.failures.get(stage, 0) + 1
+
+    def summary(self):
+        report = {}
+        for stage, values in sorted(self.samples.items()):
+            values = sorted(values)
+            pick = lambda fraction: values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+            report[stage] = {
+                "count": len(values),
+                "p50_ms": round(pick(0.50), 1),
+                "p95_ms": round(pick(0.95), 1),
+                "p99_ms": round(pick(0.99), 1),
+                "max_ms": round(values[-1] * 1000, 1),
+            }
+        return report
+
+def fake_image_bytes(seed: int):
+    """A distinct JPEG per seed, so uploads are not all deduplicated by the upload cache."""
+    image = Image.new("RGB", (1600, 1200), (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+def wait_for_renders(services, pending_fields, deadline_seconds: float):
+    """Blocks until every job queued by a turn has finished; returns the jobs' final statuses."""
+    job_ids = [pending_fields["render_job"]] if "render_job" in pending_fields else [
+        v["render_job"] for v in pending_fields.get("variants", []) if v.get("render_job")
+    ]
+    deadline = time.monotonic() + deadline_seconds
+    statuses = []
+    for job_id in job_ids:
+        job = services.render_queue.get(job_id)
+        while job and not job.done and time.monotonic() < deadline:
+            time.sleep(RENDER_WAIT_POLL_SECONDS)
+        statuses.append(job.status if job else "lost")
+    return statuses
+
+def run_conversation(number: int, script: dict, services, digest, recorder, args):
+    model = FakeGeminiModel(FakeLatency(args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_failure_rate), args.gemini_first_token_ms)
+    state = new_session_state(f"bench-{number}")
+    history = []
+    memory = ConversationMemory()
+    uploaded_url = None
+    for turn in script["turns"]:
+        turn_start = time.perf_counter()
+        prompt = turn["user"]
+        history.append({"role": "user", "content": prompt})
+
+        if turn.get("upload"):
+            start = time.perf_counter()
+            uploaded_url = image_uploader.upload_image_to_freeimage(fake_image_bytes(number), max_edge=1350)
+            recorder.add("upload", time.perf_counter() - start)
+            if not uploaded_url:
+                recorder.fail("upload")
+
+        decision = None if args.no_router or turn.get("upload") else route_message(prompt, state["design_context"])
+        response_text = None
+        if decision is None:
+            reply = turn["model"]
+            if isinstance(reply, dict):
+                reply = json.loads(json.dumps(reply).replace("{uploaded_url}", uploaded_url or ""))
+            model.reply = reply
+            start = time.perf_counter()
+            candidate_uids = select_prompt_templates(services.template_index, prompt, state["design_context"])
+            response = generate_gemini_response(model, history[:-1], prompt, digest.render(candidate_uids), state["design_context"], stream=True, memory=memory)
+            kind, payload = read_gemini_stream(response) if response else (None, None)
+            recorder.add("gemini", time.perf_counter() - start)
+            if kind == "function_call":
+                decision = payload
+            elif kind == "text":
+                response_text = payload
+            else:
+                recorder.fail("gemini")
+                response_text = "I'm having trouble connecting right now."
+
+        if decision is not None:
+            start = time.perf_counter()
+            response_text = handle_ai_decision(decision, state, services)
+            recorder.add("decision", time.perf_counter() - start)
+
+        pending_fields, state["pending_message_fields"] = state["pending_message_fields"], {}
+        if pending_fields:
+            start = time.perf_counter()
+            statuses = wait_for_renders(services, pending_fields, args.render_deadline)
+            recorder.add("render", time.perf_counter() - start)
+            for status in statuses:
+                if status != "completed":
+                    recorder.fail(f"render_{status}")
+
+        history.append({"role": "assistant", "content": response_text or ""})
+        recorder.add("turn", time.perf_counter() - turn_start)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the chat turn and render hot paths against local fakes.")
+    parser.add_argument("--script", type=Path, default=DEFAULT_SCRIPT, help="JSON file of scripted conversations.")
+    parser.add_argument("--conversations", type=int, default=20, help="Total conversations to replay (cycling through the script).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Conversations replayed at the same time.")
+    parser.add_argument("--templates", type=int, default=40, help="Size of the fake template catalog.")
+    parser.add_argument("--api-latency-ms", type=float, default=60, help="Base latency of fake Bannerbear responses.")
+    parser.add_argument("--api-jitter-ms", type=float, default=40)
+    parser.add_argument("--api-failure-rate", type=float, default=0.0, help="Probability a fake Bannerbear/upload request returns 500.")
+    parser.add_argument("--upload-latency-ms", type=float, default=250)
+    parser.add_argument("--render-seconds", type=float, default=1.5, help="Time until a fake render completes.")
+    parser.add_argument("--render-jitter-seconds", type=float, default=1.0)
+    parser.add_argument("--render-failure-rate", type=float, default=0.0)
+    parser.add_argument("--render-deadline", type=float, default=60, help="How long the harness waits for a turn's renders.")
+    parser.add_argument("--render-workers", type=int, default=8)
+    parser.add_argument("--gemini-latency-ms", type=float, default=700, help="Total fake Gemini generation time after the first token.")
+    parser.add_argument("--gemini-jitter-ms", type=float, default=300, help="Random extra generation time, up to this much.")
+    parser.add_argument("--gemini-first-token-ms", type=float, default=350)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0)
+    parser.add_argument("--no-router", action="store_true", help="Send every turn to the fake Gemini, bypassing the intent router.")
+    parser.add_argument("--no-render-cache", action="store_true", help="Disable the render cache so every GENERATE renders.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", type=Path, help="Also write the report to this file.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    scripts = json.loads(args.script.read_text(encoding="utf-8"))
+    telemetry.TRACE_LOG_PATH = ""
+
+    server = FakeApiServer(
+        make_fake_templates(args.templates),
+        FakeLatency(args.api_latency_ms, args.api_jitter_ms, args.api_failure_rate),
+        render_seconds=args.render_seconds,
+        render_jitter_seconds=args.render_jitter_seconds,
+        render_failure_rate=args.render_failure_rate,
+        upload_latency=FakeLatency(args.upload_latency_ms, args.api_jitter_ms, args.api_failure_rate),
+    ).start()
+    bannerbear_helpers.BASE_URL = f"{server.base_url}/v2"
+    image_uploader.FREEIMAGE_API_URL = f"{server.base_url}/api/1/upload"
+
+    try:
+        templates, catalog_seconds = bannerbear_helpers.load_template_catalog("bench-key")
+        if not templates:
+            raise SystemExit("Could not load the fake template catalog.")
+        digest, index = TemplateDigest(), TemplateRetrievalIndex()
+        digest.sync(templates)
+        index.sync(templates)
+        render_cache = RenderCache(max_entries=0 if args.no_render_cache else 512)
+        services = DesignServices(templates, index, render_cache, RenderQueue("bench-key", max_workers=args.render_workers, render_cache=render_cache))
+
+        recorder = LatencyRecorder()
+        work = list(zip(range(args.conversations), itertools.cycle(scripts)))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench") as pool:
+            for future in [pool.submit(run_conversation, n, script, services, digest, recorder, args) for n, script in work]:
+                future.result()
+        wall_seconds = time.perf_counter() - start
+
+        turns = len(recorder.samples.get("turn", []))
+        report = {
+            "config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            "catalog_load_seconds": round(catalog_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "conversations_per_second": round(args.conversations / wall_seconds, 3),
+            "turns_per_second": round(turns / wall_seconds, 3),
+            "stages": recorder.summary(),
+            "failures": recorder.failures,
+            "intent_router": router_stats(),
+            "render_cache": {"hits": render_cache.hits, "misses": render_cache.misses},
+            "fake_api_requests": server.requests,
+        }
+    finally:
+        server.stop()
+
+    print(f"{args.conversations} conversations / {turns} turns in {wall_seconds:.2f}s "
+          f"({report['turns_per_second']} turns/s, concurrency {args.concurrency})")
+    print(f"{'stage':<10}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<10}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    if report["failures"]:
+        print(f"failures: {report['failures']}")
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
 import streamlit as st
 import os
-import requests
+import time
+import uuid
 from dotenv import load_dotenv
 
 from pathlib import Path
 
-from bannerbear_helpers import get_template_details, create_image, poll_for_image
-from gemini_helpers import get_gemini_model, generate_gemini_response
+import design_flow
+from bannerbear_helpers import start_webhook_listener, WEBHOOK_URL
+from design_flow import DesignServices, new_design_context, render_job_message
+from conversation_memory import ConversationMemory
+from gemini_helpers import get_gemini_model, build_gemini_conversation, conversation_text, send_gemini_conversation, read_gemini_stream, response_token_usage
 from image_uploader import upload_image_to_freeimage
+from intent_router import route_message, router_stats
+from render_cache import RenderCache
+from render_queue import RenderQueue
+from telemetry import approx_size, observe, process_uptime, record_session_size, register_gauge, session_size_stats, start_metrics_server, start_trace
+from template_index import LayerIndex, TemplateDigest, TemplateRetrievalIndex, estimate_tokens, max_image_layer_size, select_prompt_templates
+from template_store import TemplateStore
 from ui_helpers import inject_css, typing_indicator
 
+SCRIPT_START = time.perf_counter()
+
 st.set_page_config(page_title="ROA AI Designer", layout="centered")
 inject_css()
 
@@ -22,100 +34,197 @@ load_dotenv()
 BB_API_KEY, GEMINI_API_KEY = os.getenv("BANNERBEAR_API_KEY"), os.getenv("GEMINI_API_KEY")
 
 @st.cache_resource(show_spinner="Loading design templates...")
+def get_template_store():
+    """One disk-backed template store per process; it starts from the on-disk snapshot and revalidates in the background."""
+    return TemplateStore(BB_API_KEY)
+
+@st.cache_resource
+def get_template_digest():
+    """Process-wide compact template digest for the Gemini prompt, rebuilt only when the catalog changes."""
+    return TemplateDigest()
+
+@st.cache_resource
+def get_template_index():
+    """Process-wide retrieval index used to pick the candidate templates sent to Gemini each turn."""
+    return TemplateRetrievalIndex()
+
+@st.cache_resource
+def get_layer_index():
+    """Process-wide per-template layer tables used to validate modifications before rendering."""
+    return LayerIndex()
+
+@st.cache_resource
+def start_render_webhook_listener():
+    """Starts the Bannerbear webhook listener once per process when a webhook URL and secret are configured."""
+    if WEBHOOK_URL:
+        return start_webhook_listener(int(os.getenv("BANNERBEAR_WEBHOOK_PORT", "8502")))
+    return None
+
+@st.cache_resource
+def get_render_cache():
+    """Process-wide cache of finished renders, so repeat generations of the same design skip Bannerbear."""
+    return RenderCache()
+
+@st.cache_resource
+def get_render_queue():
+    """Process-wide render queue; renders run on its worker pool instead of the session's script thread."""
+    return RenderQueue(BB_API_KEY, render_cache=get_render_cache())
+
+@st.cache_resource
+def start_telemetry():
+    """Registers process-wide gauges and serves Prometheus metrics when METRICS_PORT is set."""
+    render_cache, digest = get_render_cache(), get_template_digest()
+    register_gauge("intent_router_turns", router_stats)
+    register_gauge("render_cache", lambda: {"hits": render_cache.hits, "misses": render_cache.misses, "entries": len(render_cache)})
+    register_gauge("render_queue_depth", get_render_queue().depth)
+    register_gauge("template_digest_tokens_est", lambda: {"raw": digest.tokens_before, "digest": digest.tokens_after})
+    register_gauge("session_state_bytes", session_size_stats)
+    port = os.getenv("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
 def load_all_template_details():
-    try:
-        if not BB_API_KEY: return None
-        summary_url = "https://api.bannerbear.com/v2/templates"
-        headers = {"Authorization": f"Bearer {BB_API_KEY}"}
-        response = requests.get(summary_url, headers=headers, timeout=15)
-        response.raise_for_status()
-        summary = response.json()
-        return [get_template_details(BB_API_KEY, t['uid']) for t in summary if t]
-    except Exception as e:
-        st.error(f"Error loading templates: {e}", icon="🚨")
+    if not BB_API_KEY: return None
+    templates = get_template_store().templates()
+    if not templates:
+        st.error("Error loading templates: the Bannerbear template list could not be fetched.", icon="🚨")
         return None
+    return templates
+
+@st.cache_resource
+def record_cold_start():
+    """
+    Runs once per process, at the end of its first script run. `first_script_run` is that run alone
+    (after the imports); `app_cold_start` is from process start, so it includes interpreter and
+    Streamlit boot and every import, and is only recorded where the process start time is known.
+    """
+    first_run = time.perf_counter() - SCRIPT_START
+    observe("first_script_run", first_run)
+    cold_start = process_uptime()
+    if cold_start is not None:
+        observe("app_cold_start", cold_start)
+    print(f"First script run took {first_run:.2f}s" + (f", {cold_start:.2f}s since process start" if cold_start is not None else ""))
+    return first_run
 
 def initialize_session_state():
+    """
+    Per-session state holds only this user's conversation and design. The Gemini model, the template
+    catalog and its indexes are process-wide and shared by every session.
+    """
+    start = time.perf_counter()
+    is_new_session = "session_id" not in st.session_state
     defaults = {
         "messages": [{"role": "assistant", "content": "Hello! I'm your design assistant. Just tell me what you need to create."}],
-        "gemini_model": get_gemini_model(GEMINI_API_KEY),
-        "rich_templates_data": load_all_template_details(),
-        "design_context": {"template_uid": None, "modifications": []},
-        "staged_file": None
+        "design_context": new_design_context(),
+        "conversation_memory": ConversationMemory(),
+        "staged_file": None,
+        "session_id": uuid.uuid4().hex,
+        "pending_message_fields": {}
     }
     for key, default_value in defaults.items():
         if key not in st.session_state: st.session_state[key] = default_value
+    if is_new_session:
+        observe("session_init", time.perf_counter() - start)
+
+def get_design_services():
+    return DesignServices(get_template_store().templates(), get_template_index(), get_render_cache(), get_render_queue(), get_layer_index())
 
 def handle_ai_decision(decision):
-    """The central router that executes the AI's chosen action."""
-    action = decision.get("action")
-    response_text = decision.get("response_text", "I'm not sure how to proceed.")
-    trigger_generation = False
-    
-    if action == "CONVERSE":
-        return response_text
-
-    if action == "MODIFY":
-        new_template_uid = decision.get("template_uid")
-        if new_template_uid and new_template_uid != st.session_state.design_context.get("template_uid"):
-            if st.session_state.design_context.get("template_uid") is not None:
-                trigger_generation = True
-            st.session_state.design_context["template_uid"] = new_template_uid
-
-        current_mods_dict = {mod['name']: mod for mod in st.session_state.design_context.get('modifications', [])}
-        new_mods_from_ai = decision.get("modifications", [])
-        for mod in new_mods_from_ai:
-            current_mods_dict[mod['name']] = dict(mod)
-        
-        st.session_state.design_context["modifications"] = list(current_mods_dict.values())
+    """Executes the AI's chosen action against this session's state."""
+    return design_flow.handle_ai_decision(decision, st.session_state, get_design_services())
 
-    elif action == "GENERATE":
-        trigger_generation = True
+def update_variants(msg):
+    """Copies finished job results into a gallery message. Returns True once no variant is still rendering."""
+    all_done = True
+    for variant in msg["variants"]:
+        if not variant.get("render_job"):
+            continue
+        job = get_render_queue().get(variant["render_job"])
+        if job is None or job.done:
+            variant["image_url"] = job.image_url if job else None
+            del variant["render_job"]
+        else:
+            all_done = False
+    return all_done
 
-    elif action == "RESET":
-        st.session_state.design_context = {"template_uid": None, "modifications": []}
-        return response_text 
+def choose_variant(variant):
+    """Switches the design to the picked variant's template, keeping all modifications."""
+    st.session_state.design_context["template_uid"] = variant["template_uid"]
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": f"Great choice! I've switched your design to **{variant['name']}**.\n\n![Generated Image]({variant['image_url']})"
+    })
 
-    if trigger_generation:
-        context = st.session_state.design_context
-        if not context.get("template_uid"):
-            return "I can't generate an image yet. Please describe the design you want first."
-        
-        with st.spinner("Generating your image... This may take a moment."):
-            final_modifications = context.get("modifications", [])
-            initial_response = create_image(BB_API_KEY, context['template_uid'], final_modifications)
-            
-            if not initial_response:
-                response_text = "❌ **Error:** Failed to start image generation."
+def show_variant_gallery(msg, msg_index, pending=False):
+    st.markdown(msg["content"], unsafe_allow_html=True)
+    for column, variant in zip(st.columns(len(msg["variants"])), msg["variants"]):
+        with column:
+            if variant.get("image_url"):
+                st.image(variant["image_url"], caption=variant["name"])
+                if not pending:
+                    st.button("Use this style", key=f"variant-{msg_index}-{variant['template_uid']}", on_click=choose_variant, args=(variant,))
+            elif variant.get("render_job"):
+                st.caption(f"🎨 Rendering {variant['name']}...")
             else:
-                final_image = poll_for_image(BB_API_KEY, initial_response)
-                if final_image and final_image.get("image_url_png"):
-                    response_text += f"\n\n![Generated Image]({final_image['image_url_png']})"
-                else:
-                    response_text = "❌ **Error:** Image generation failed during rendering."
+                st.caption(f"❌ Couldn't render {variant['name']}.")
+
+@st.fragment(run_every=1)
+def show_pending_variants(msg, msg_index):
+    """Shows a variant gallery while its renders are running, switching to the selectable gallery once all finish."""
+    if update_variants(msg):
+        st.rerun()
+    show_variant_gallery(msg, msg_index, pending=True)
 
-    return response_text
+@st.fragment(run_every=1)
+def show_pending_render(msg):
+    """Shows a message whose render is still queued, filling in the image once the job finishes."""
+    job = get_render_queue().get(msg["render_job"])
+    if job is None or job.done:
+        msg["content"] = render_job_message(msg["content"], job)
+        del msg["render_job"]
+        st.rerun()
+    st.markdown(msg["content"], unsafe_allow_html=True)
+    st.caption("🎨 Rendering your image... you can keep chatting.")
 
 initialize_session_state()
+start_render_webhook_listener()
+start_telemetry()
+templates = load_all_template_details()
 
-if not st.session_state.rich_templates_data:
+if not templates:
     st.error("Application cannot start because design templates could not be loaded. Please ensure your BANNERBEAR_API_KEY is correct and restart.", icon="🛑")
     st.stop()
+get_template_digest().sync(templates)
+get_template_index().sync(templates)
+get_layer_index().sync(templates)
+record_cold_start()
+record_session_size(st.session_state.session_id, approx_size(st.session_state.to_dict()))
 
 with st.sidebar:
+    if st.button("Refresh templates", help="Re-check Bannerbear for new or edited templates without restarting the app."):
+        get_template_store().refresh(background=True, force=True)
+        st.toast("Refreshing templates in the background...")
     st.header("Upload Image")
     staged_file_bytes = st.file_uploader("Attach an image to your next message", type=["png", "jpg", "jpeg"])
     if staged_file_bytes:
         st.session_state.staged_file = staged_file_bytes.getvalue()
         st.success("✅ Image attached and ready!")
 
-for msg in st.session_state.messages:
+for msg_index, msg in enumerate(st.session_state.messages):
     with st.chat_message(msg["role"]):
-        st.markdown(msg["content"], unsafe_allow_html=True)
+        if msg.get("render_job"):
+            show_pending_render(msg)
+        elif msg.get("variants"):
+            if update_variants(msg):
+                show_variant_gallery(msg, msg_index)
+            else:
+                show_pending_variants(msg, msg_index)
+        else:
+            st.markdown(msg["content"], unsafe_allow_html=True)
 
 if prompt := st.chat_input("Your message..."):
     st.chat_message("user").markdown(prompt)
     st.session_state.messages.append({"role": "user", "content": prompt})
+    trace = start_trace("turn", session_id=st.session_state.session_id)
 
     with st.chat_message("assistant"):
         placeholder = st.empty()
@@ -123,40 +232,71 @@ if prompt := st.chat_input("Your message..."):
         
         final_prompt_for_ai = prompt
         if st.session_state.staged_file:
-            with st.spinner("Uploading your image..."):
-                image_url = upload_image_to_freeimage(st.session_state.staged_file) 
+            with st.spinner("Uploading your image..."), trace.span("upload", bytes=len(st.session_state.staged_file)) as span:
+                image_url = upload_image_to_freeimage(st.session_state.staged_file, max_edge=max_image_layer_size(templates))
                 st.session_state.staged_file = None
                 if image_url:
                     final_prompt_for_ai = f"Image context: The user has just uploaded an image, available at {image_url}. Their text command is: '{prompt}'"
                 else:
+                    span["error"] = "upload_failed"
                     placeholder.error("Image upload failed.", icon="❌")
                     final_prompt_for_ai = None
 
         response_text = "I'm sorry, something went wrong. Could you please try rephrasing?"
-        if final_prompt_for_ai:
-            response = generate_gemini_response(
-                model=st.session_state.gemini_model,
-                chat_history=st.session_state.messages,
-                user_prompt=final_prompt_for_ai,
-                rich_templates_data=st.session_state.rich_templates_data,
-                current_design_context=st.session_state.design_context
-            )
-            
-            if response and response.candidates:
-                part = response.candidates[0].content.parts[0]
-                # Case 1: The AI returned a function call (the primary workflow).
-                if hasattr(part, 'function_call') and part.function_call:
-                    decision = dict(part.function_call.args)
-                    response_text = handle_ai_decision(decision)
-                # Case 2: The AI returned a direct text response for conversation.
-                elif hasattr(part, 'text') and part.text:
-                    response_text = part.text
-                # Case 3: The response was malformed or empty.
-                else:
-                    response_text = "I'm having trouble connecting right now. Please try again in a moment."
-            # Case 4: The API call itself failed or returned no candidates.
+        # Obvious greetings, resets and "show me" turns are answered locally without a Gemini round trip.
+        with trace.span("route") as span:
+            local_decision = route_message(prompt, st.session_state.design_context) if final_prompt_for_ai == prompt else None
+            span["handled_locally"] = bool(local_decision)
+        if local_decision:
+            with trace.span("decision", action=local_decision["action"]):
+                response_text = handle_ai_decision(local_decision)
+        elif final_prompt_for_ai:
+            with trace.span("prompt_build") as span:
+                candidate_uids = select_prompt_templates(get_template_index(), prompt, st.session_state.design_context)
+                conversation = build_gemini_conversation(
+                    chat_history=st.session_state.messages[:-1],
+                    user_prompt=final_prompt_for_ai,
+                    templates_digest=get_template_digest().render(candidate_uids),
+                    current_design_context=st.session_state.design_context,
+                    memory=st.session_state.conversation_memory
+                )
+                span["candidate_templates"] = len(candidate_uids) if candidate_uids is not None else "all"
+                prompt_text = conversation_text(conversation)
+                span["prompt_chars"] = len(prompt_text)
+                span["prompt_tokens_est"] = estimate_tokens(prompt_text)
+
+            # Partial text is shown as it streams in; the action runs once the function call is complete.
+            with trace.span("gemini") as span:
+                gemini_start = time.perf_counter()
+                def show_partial_text(text):
+                    span.setdefault("first_token_ms", round((time.perf_counter() - gemini_start) * 1000, 2))
+                    placeholder.markdown(text + " ▌", unsafe_allow_html=True)
+
+                response = send_gemini_conversation(get_gemini_model(GEMINI_API_KEY), conversation, stream=True)
+                kind, payload = None, None
+                if response:
+                    kind, payload = read_gemini_stream(response, on_text=show_partial_text)
+                    span.update(response_token_usage(response))
+                span["result"] = kind
+                if kind is None:
+                    span["error"] = "gemini_failed" if not response else "empty_response"
+
+            # Case 1: The AI returned a function call (the primary workflow).
+            if kind == "function_call":
+                with trace.span("decision", action=payload.get("action")):
+                    response_text = handle_ai_decision(payload)
+            # Case 2: The AI returned a direct text response for conversation.
+            elif kind == "text":
+                response_text = payload
+            # Case 3: The API call failed, or the response was malformed or empty.
             else:
                 response_text = "I'm having trouble connecting right now. Please try again in a moment."
 
         placeholder.markdown(response_text, unsafe_allow_html=True)
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
\ No newline at end of file
+    pending_fields = st.session_state.pending_message_fields
+    st.session_state.pending_message_fields = {}
+    st.session_state.messages.append({"role": "assistant", "content": response_text, **pending_fields})
+    trace.finish(render_jobs=[pending_fields["render_job"]] if "render_job" in pending_fields
+                 else [v["render_job"] for v in pending_fields.get("variants", []) if v.get("render_job")])
+    if pending_fields:
+        st.rerun()
@@ -0,0 +1,83 @@
+import os
+import re
+
+from template_index import estimate_tokens
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_SUMMARY_TOKEN_BUDGET", "300"))
+MAX_MESSAGE_TOKENS = 400
+SUMMARY_LINE_CHARS = 120
+
+_IMAGE_MARKDOWN_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+
+def message_text(msg: dict):
+    """
+    The text of a chat message as the model should see it. Rendered images are replaced by a
+    short note (the URL is useless to the model) and variant galleries list the styles shown.
+    """
+    text = msg.get("content", "")
+    if msg.get("variants"):
+        names = ", ".join(v["name"] for v in msg["variants"])
+        text += f"\n(Showed style variants for the user to pick from: {names}.)"
+    if _IMAGE_MARKDOWN_RE.search(text):
+        text = _IMAGE_MARKDOWN_RE.sub("", text).strip() + "\n(The generated image of the current design was shown here.)"
+    return text.strip()
+
+def _clip(text: str, max_tokens: int):
+    """Shortens overly long text (e.g. a pasted listing description) by cutting out its middle."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]} […] {text[-half:]}"
+
+def _summary_line(msg: dict):
+    speaker = "User" if msg["role"] == "user" else "Assistant"
+    text = " ".join(message_text(msg).split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 1] + "…"
+    return f"- {speaker}: {text}"
+
+class ConversationMemory:
+    """
+    Keeps the history sent to Gemini within a token budget. The most recent messages are kept
+    verbatim (each clipped to MAX_MESSAGE_TOKENS); older ones are folded, once, into a running
+    summary of one line per message, itself capped at SUMMARY_TOKEN_BUDGET by dropping its oldest
+    lines. The authoritative design state travels separately in `design_context`.
+    """
+
+    def __init__(self, history_budget: int = HISTORY_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET):
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self.summary_lines = []
+        self.omitted = 0
+        self._folded_upto = 0
+
+    def window(self, messages: list):
+        """Returns (summary_text, recent) where recent is a list of (role, text) pairs, oldest first."""
+        recent, used = [], 0
+        first_verbatim = len(messages)
+        for index in range(len(messages) - 1, self._folded_upto - 1, -1):
+            text = _clip(message_text(messages[index]), MAX_MESSAGE_TOKENS)
+            if not text:
+                continue
+            cost = estimate_tokens(text)
+            if recent and used + cost > self.history_budget:
+                break
+            recent.append((messages[index]["role"], text))
+            used += cost
+            first_verbatim = index
+        recent.reverse()
+
+        for msg in messages[self._folded_upto:first_verbatim]:
+            if message_text(msg):
+                self.summary_lines.append(_summary_line(msg))
+        self._folded_upto = max(self._folded_upto, first_verbatim)
+        while self.summary_lines and estimate_tokens("\n".join(self.summary_lines)) > self.summary_budget:
+            self.summary_lines.pop(0)
+            self.omitted += 1
+
+        summary = "\n".join(self.summary_lines)
+        if summary and self.omitted:
+            summary = f"({self.omitted} earlier messages omitted)\n{summary}"
+        return summary, recent
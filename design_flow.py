@@ -0,0 +1,152 @@
+import os
+
+from template_index import LayerIndex, find_compatible_templates
+
+VARIANT_COUNT = int(os.getenv("VARIANT_COUNT", "3"))
+
+class DesignServices:
+    """
+    The shared objects a design session works against: the template catalog, its retrieval index,
+    the render cache, the render queue and the layer index (built from `templates` if not given).
+    """
+
+    def __init__(self, templates, template_index, render_cache, render_queue, layer_index=None):
+        self.templates = templates
+        self.template_index = template_index
+        self.render_cache = render_cache
+        self.render_queue = render_queue
+        if layer_index is None:
+            layer_index = LayerIndex()
+            layer_index.sync(templates)
+        self.layer_index = layer_index
+
+def new_design_context():
+    return {"template_uid": None, "modifications": []}
+
+def new_session_state(session_id: str):
+    """The per-session state `handle_ai_decision` reads and updates, for use outside Streamlit."""
+    return {"design_context": new_design_context(), "session_id": session_id, "pending_message_fields": {}}
+
+def handle_ai_decision(decision, state, services):
+    """
+    The central router that executes the AI's chosen action.
+    `state` is the session's mapping (Streamlit's session_state or a plain dict) holding
+    `design_context`, `session_id` and `pending_message_fields`. Renders that are queued rather
+    than answered from the cache are reported through `state["pending_message_fields"]`.
+    """
+    action = decision.get("action")
+    response_text = decision.get("response_text", "I'm not sure how to proceed.")
+    trigger_generation = False
+
+    if action == "CONVERSE":
+        return response_text
+
+    if action == "MODIFY":
+        layer_index = services.layer_index
+        notes = []
+        new_template_uid = decision.get("template_uid")
+        current_template_uid = state["design_context"].get("template_uid")
+        new_mods_from_ai = decision.get("modifications", [])
+        dropped, dropped_from_ai = [], []
+        if new_template_uid and new_template_uid != current_template_uid:
+            if layer_index.layers(new_template_uid) is None:
+                return "❌ **Error:** I picked a template that doesn't exist. Could you describe the design you want again?"
+            if current_template_uid is not None:
+                trigger_generation = True
+                # Carry the details over onto the new template's closest matching layers.
+                remapped, dropped, renamed = layer_index.remap(current_template_uid, new_template_uid, state["design_context"].get("modifications", []))
+                state["design_context"]["modifications"] = remapped
+                # Gemini resends the previous modifications under the old layer names when switching, so move them too.
+                new_mods_from_ai, dropped_from_ai, renamed_from_ai = layer_index.remap(current_template_uid, new_template_uid, new_mods_from_ai)
+                renamed += [pair for pair in renamed_from_ai if pair not in renamed]
+                if renamed:
+                    notes.append(f"ℹ️ **Moved:** {', '.join(f'`{old}` → `{new}`' for old, new in renamed)} (the new template names these layers differently).")
+                if dropped:
+                    notes.append(f"⚠️ **Not carried over:** {', '.join(f'`{name}`' for name in dropped)} (the new template has no matching layer).")
+            state["design_context"]["template_uid"] = new_template_uid
+
+        valid_mods, problems = layer_index.validate(state["design_context"].get("template_uid"), new_mods_from_ai) if new_mods_from_ai else ([], [])
+        problems += [f"`{name}` is not a layer of this template" for name in dropped_from_ai if name not in dropped]
+        if problems:
+            notes.append(f"⚠️ **Not applied:** {'; '.join(problems)}.")
+
+        current_mods_dict = {mod['name']: mod for mod in state["design_context"].get('modifications', [])}
+        for mod in valid_mods:
+            current_mods_dict[mod['name']] = mod
+
+        state["design_context"]["modifications"] = list(current_mods_dict.values())
+        if notes:
+            response_text += "\n\n" + "\n\n".join(notes)
+
+    elif action == "GENERATE":
+        trigger_generation = True
+
+    elif action == "VARIANTS":
+        return start_variant_renders(response_text, state, services)
+
+    elif action == "RESET":
+        state["design_context"] = new_design_context()
+        return response_text
+
+    if trigger_generation:
+        context = state["design_context"]
+        if not context.get("template_uid"):
+            return "I can't generate an image yet. Please describe the design you want first."
+
+        final_modifications, problems = services.layer_index.validate(context["template_uid"], context.get("modifications", []))
+        if problems:
+            return f"❌ **Error:** This design can't be rendered as it is: {'; '.join(problems)}. Please tell me what to change."
+        template_version = services.layer_index.version(context['template_uid'])
+        cached_url = services.render_cache.get(context['template_uid'], final_modifications, template_version)
+        if cached_url:
+            return response_text + f"\n\n![Generated Image]({cached_url})"
+
+        job = services.render_queue.submit(state["session_id"], context['template_uid'], final_modifications, template_version)
+        if job.status == "rejected":
+            return f"❌ **Error:** {job.error} Please try again in a moment."
+        state["pending_message_fields"] = {"render_job": job.id}
+
+    return response_text
+
+def start_variant_renders(response_text, state, services):
+    """Renders the current design on up to VARIANT_COUNT other compatible templates at once, for a pick-one gallery."""
+    context = state["design_context"]
+    if not context.get("template_uid") or not context.get("modifications"):
+        return "Let's start a design first, then I can show you a few different styles for it."
+
+    compatible = find_compatible_templates(services.templates, context["modifications"], exclude={context["template_uid"]})
+    if not compatible:
+        return "I couldn't find another template that fits all of your details. Would you like to start a new design instead?"
+    # Prefer templates whose names resemble the current one, so variants serve the same purpose.
+    index = services.template_index
+    similar = index.search(index.name_of(context["template_uid"]), k=len(compatible))
+    rank = {uid: position for position, (uid, _) in enumerate(similar)}
+    compatible.sort(key=lambda t: rank.get(t["uid"], len(rank)))
+
+    variants, to_render = [], []
+    versions = {template["uid"]: services.layer_index.version(template["uid"]) for template in compatible[:VARIANT_COUNT]}
+    for template in compatible[:VARIANT_COUNT]:
+        cached_url = services.render_cache.get(template["uid"], context["modifications"], versions[template["uid"]])
+        variant = {"template_uid": template["uid"], "name": template.get("name", "Untitled"), "image_url": cached_url}
+        variants.append(variant)
+        if not variant["image_url"]:
+            to_render.append(variant)
+    if to_render:
+        # Only when something is queued: submitting supersedes the session's in-flight renders.
+        jobs = services.render_queue.submit_many(state["session_id"], [(v["template_uid"], context["modifications"], versions[v["template_uid"]]) for v in to_render])
+        for variant, job in zip(to_render, jobs):
+            variant["render_job"] = job.id
+    state["pending_message_fields"] = {"variants": variants}
+    return response_text
+
+def render_job_message(response_text, job):
+    """Builds the final chat message for a finished render job."""
+    if job is None:
+        return "❌ **Error:** The render was lost. Please ask me to generate it again."
+    if job.status == "completed":
+        return response_text + f"\n\n![Generated Image]({job.image_url})"
+    if job.status == "timed_out":
+        return "⏳ **Still rendering:** Bannerbear is taking longer than usual. Please ask me to show it again in a moment."
+    if job.status == "cancelled":
+        return response_text + "\n\n_This render was replaced by a newer request._"
+    return f"❌ **Error:** {job.error or 'Image generation failed during rendering.'}"
@@ -1,8 +1,31 @@
-import google.generativeai as genai
 import json
+import threading
+import time
+
+from conversation_memory import ConversationMemory
+
+_models = {}  # api_key -> shared GenerativeModel
+_models_lock = threading.Lock()
 
 def get_gemini_model(api_key):
+    """
+    Returns the process-wide Gemini model for `api_key`, building it on first use. The model is
+    stateless between calls (every request carries its own conversation), so all sessions share it.
+    """
+    model = _models.get(api_key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(api_key)
+            if model is None:
+                model = _models[api_key] = build_gemini_model(api_key)
+    return model
+
+def build_gemini_model(api_key):
     """Initializes the Gemini model with a single, powerful workflow-controlling tool."""
+    start = time.perf_counter()
+    # Imported here rather than at module level: the SDK takes about a second to import and is not needed until the first AI turn.
+    import google.generativeai as genai
+    import_seconds = time.perf_counter() - start
     genai.configure(api_key=api_key)
 
     process_user_request = genai.protos.FunctionDeclaration(
@@ -13,7 +36,7 @@ def get_gemini_model(api_key):
             properties={
                 "action": genai.protos.Schema(
                     type=genai.protos.Type.STRING,
-                    description="The action to take. Must be one of: MODIFY, GENERATE, RESET, CONVERSE."
+                    description="The action to take. Must be one of: MODIFY, GENERATE, VARIANTS, RESET, CONVERSE."
                 ),
                 "template_uid": genai.protos.Schema(type=genai.protos.Type.STRING, description="Required if action is MODIFY. The UID of the template being edited."),
                 "modifications": genai.protos.Schema(
@@ -36,14 +59,30 @@ def get_gemini_model(api_key):
     )
 
     model = genai.GenerativeModel(model_name="gemini-1.5-flash", tools=[process_user_request])
+    print(f"Gemini model ready in {time.perf_counter() - start:.2f}s (SDK import {import_seconds:.2f}s)")
     return model
 
-def generate_gemini_response(model, chat_history, user_prompt, rich_templates_data, current_design_context):
-    """Generates a response from the AI, which now acts as a workflow controller."""
-    
-    context_prompt = f"""You are a super-intuitive, friendly, and helpful design assistant for Realty of America. Your entire job is to understand the user's natural language and immediately decide on ONE of four actions. You are an action-taker, not a conversationalist, but your responses in `response_text` should be friendly.
+def generate_gemini_response(model, chat_history, user_prompt, templates_digest, current_design_context, stream=False, memory=None):
+    """
+    Generates a response from the AI, which now acts as a workflow controller.
+    `templates_digest` is the compact JSON catalog from `TemplateDigest.render()`.
+    With stream=True the response is an iterable of chunks; read it with `read_gemini_stream`.
+    """
+    conversation = build_gemini_conversation(chat_history, user_prompt, templates_digest, current_design_context, memory=memory)
+    return send_gemini_conversation(model, conversation, stream=stream)
+
+def build_gemini_conversation(chat_history, user_prompt, templates_digest, current_design_context, memory=None):
+    """
+    Assembles the system prompt, the chat history and the new user message into a Gemini conversation.
+    `chat_history` excludes the new message. The session's `ConversationMemory` keeps the history
+    within its token budget, summarising older turns; without one, a fresh memory is used.
+    """
+    summary, recent = (memory or ConversationMemory()).window(chat_history)
+    summary_line = f"\n    - **EARLIER_CONVERSATION (one line per older message; CURRENT_DESIGN_CONTEXT is authoritative):**\n{summary}" if summary else ""
+
+    context_prompt = f"""You are a super-intuitive, friendly, and helpful design assistant for Realty of America. Your entire job is to understand the user's natural language and immediately decide on ONE of five actions. You are an action-taker, not a conversationalist, but your responses in `response_text` should be friendly.
 
-    **YOUR FOUR ACTIONS (You MUST choose one):**
+    **YOUR FIVE ACTIONS (You MUST choose one):**
 
     1.  **`MODIFY`**: **THIS IS YOUR MOST IMPORTANT ACTION.** Use it to start a new design or update an existing one.
         - **Starting a New Design:** If the user's request is to create something (e.g., 'make a flyer for...', 'I need an ad for 123 Main St'), you MUST autonomously select the best template from `AVAILABLE_TEMPLATES` and use this `MODIFY` action to apply all the initial details they provided.
@@ -53,10 +92,13 @@ def generate_gemini_response(model, chat_history, user_prompt, rich_templates_da
     2.  **`GENERATE`**: Use this ONLY when the user indicates they are finished and want to see the final image. They will use natural language like "okay show it to me", "let's see what it looks like", "I'm ready", "make the image now".
         - Your `response_text` should be a confirmation like "Of course! Generating your image now..."
 
-    3.  **`RESET`**: Use this when the user wants to start a completely new, different design. They will say things like "great, now I need a business card", "let's do an open house flyer next", "start over".
+    3.  **`VARIANTS`**: Use this when the user dislikes the overall layout or style of the design and wants to see alternatives (see SCENARIO 2). The app will render the current details on several other suitable templates at once and let the user pick one. Do not include `template_uid` or `modifications`.
+        - Your `response_text` should be something like "No problem! Here are a few other styles with your details."
+
+    4.  **`RESET`**: Use this when the user wants to start a completely new, different design. They will say things like "great, now I need a business card", "let's do an open house flyer next", "start over".
         - Your `response_text` should confirm you are starting fresh (e.g., "You got it! Starting a new design. What are we creating this time?").
 
-    4.  **`CONVERSE`**: Use this for secondary situations ONLY, like greetings ("hi") or if you absolutely must ask a clarifying question after a design has already been started, or if you cannot fulfill a request as per the rules below.
+    5.  **`CONVERSE`**: Use this for secondary situations ONLY, like greetings ("hi") or if you absolutely must ask a clarifying question after a design has already been started, or if you cannot fulfill a request as per the rules below.
 
     ---
     **CRITICAL SCENARIOS & RULES:**
@@ -81,30 +123,68 @@ def generate_gemini_response(model, chat_history, user_prompt, rich_templates_da
 
     - **SCENARIO 2: USER REQUESTS A COMPLETELY NEW TEMPLATE:**
         - **WHEN TO USE:** If an image was just generated and the user expresses dissatisfaction with the **overall layout or style** (e.g., "I don't like this layout," "try a completely different template," "show me another style").
-        - **YOUR ACTION:** You MUST:
-            1. Review `CURRENT_DESIGN_CONTEXT` to see the `template_uid` that was just used.
-            2. From `AVAILABLE_TEMPLATES`, autonomously select a **DIFFERENT** but still appropriate template, following the 'INTELLIGENT TEMPLATE SELECTION' rule.
-            3. Call the `MODIFY` action with the `template_uid` of the *new* template and *all* previous `modifications` from the context. This is critical to not lose user data.
-            4. Your `response_text` should be something like "No problem. Let's try a different style. Here's a new version."
+        - **YOUR ACTION:** You MUST call the `VARIANTS` action. The app re-applies *all* previous `modifications` to several compatible templates and shows them side by side.
+        - **EXCEPTION:** If the user names a specific kind of template they want instead (e.g., "use the postcard one"), select that **DIFFERENT** template yourself following the 'INTELLIGENT TEMPLATE SELECTION' rule and call `MODIFY` with its `template_uid` and *all* previous `modifications` from `CURRENT_DESIGN_CONTEXT`. This is critical to not lose user data.
 
     - **NEVER** ask the user to choose a template. Select it yourself.
     - **NEVER** tell the user to type "generate image" or "new design". Understand their intent from natural language.
 
     **REFERENCE DATA:**
-    - **AVAILABLE_TEMPLATES (with full layer details):** {json.dumps(rich_templates_data, indent=2)}
-    - **CURRENT_DESIGN_CONTEXT (The design we are building):** {json.dumps(current_design_context, indent=2)}
+    - **AVAILABLE_TEMPLATES (the templates most relevant to this message, or only the current template while refining it unless the user names another one; uid, name, and modifiable layers as layer name -> layer type; only put `text` on text layers and `image_url` on image layers):** {templates_digest}
+    - **CURRENT_DESIGN_CONTEXT (The design we are building):** {json.dumps(current_design_context, indent=2)}{summary_line}
     """
 
     conversation = [{'role': 'user', 'parts': [context_prompt]}, {'role': 'model', 'parts': ["Understood. I am an action-oriented design assistant. I will distinguish between refining a current design and requests for a new template based on intelligent analysis. My primary goal is to use the `MODIFY` action immediately to start or update a design based on the user's request."]}]
-    for msg in chat_history[-8:]:
-        if msg['role'] == 'user':
-            conversation.append({'role': 'user', 'parts': [msg['content']]})
-        elif msg['role'] == 'assistant' and '![Generated Image]' not in msg['content']:
-            conversation.append({'role': 'model', 'parts': [msg['content']]})
-    conversation.append({'role': 'user', 'parts': [user_prompt]})
-    
+    for role, text in recent + [('user', user_prompt)]:
+        role = 'user' if role == 'user' else 'model'
+        # Gemini expects alternating turns, so consecutive messages from one side share a turn.
+        if conversation[-1]['role'] == role:
+            conversation[-1]['parts'].append(text)
+        else:
+            conversation.append({'role': role, 'parts': [text]})
+    return conversation
+
+def conversation_text(conversation):
+    """All text parts of a conversation joined together, for prompt-size metrics."""
+    return "\n".join(part for message in conversation for part in message['parts'])
+
+def send_gemini_conversation(model, conversation, stream=False):
     try:
-        return model.generate_content(conversation)
+        return model.generate_content(conversation, stream=stream)
     except Exception as e:
         print(f"Error generating Gemini response: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def read_gemini_stream(response, on_text=None):
+    """
+    Consumes a streamed Gemini response. Plain text parts and a function call's `response_text`
+    are passed to `on_text` (with the full text so far) as soon as they arrive.
+    Returns ("function_call", args) once the call's arguments are complete, ("text", text), or (None, None).
+    """
+    text = ""
+    try:
+        for chunk in response:
+            if not chunk.candidates:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if getattr(part, 'function_call', None) and part.function_call.name:
+                    args = dict(part.function_call.args)
+                    if on_text and args.get("response_text"):
+                        on_text(args["response_text"])
+                    return "function_call", args
+                if getattr(part, 'text', None):
+                    text += part.text
+                    if on_text:
+                        on_text(text)
+    except Exception as e:
+        print(f"Error streaming Gemini response: {e}")
+        return None, None
+    return ("text", text) if text else (None, None)
+
+def response_token_usage(response):
+    """Prompt/response token counts reported by Gemini, when the response carries usage metadata."""
+    try:
+        usage = response.usage_metadata
+        return {"prompt_tokens": usage.prompt_token_count, "response_tokens": usage.candidates_token_count}
+    except Exception:
+        return {}
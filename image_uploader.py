@@ -1,25 +1,68 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
 import requests
-import base64
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+FREEIMAGE_API_URL = "https://freeimage.host/api/1/upload"
+DEFAULT_MAX_EDGE = 2048
+JPEG_QUALITY = 85
+UPLOAD_CACHE_MAX_ENTRIES = 256
+
+_upload_cache = OrderedDict()  # sha256 of the original bytes -> hosted URL
+_upload_cache_lock = threading.Lock()
 
-def upload_image_to_freeimage(image_bytes: bytes):
+def preprocess_image(image_bytes: bytes, max_edge: int = DEFAULT_MAX_EDGE):
+    """
+    Prepares an image for upload: applies the EXIF orientation, downsizes so the longest edge is at
+    most `max_edge`, drops all metadata (EXIF, GPS) and re-encodes as JPEG, or optimized PNG when
+    the image has transparency. Returns (bytes, filename, mime type); unreadable input is returned as-is.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as original:
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            output = io.BytesIO()
+            if has_alpha:
+                image.save(output, format="PNG", optimize=True)
+                return output.getvalue(), "upload.png", "image/png"
+            image.convert("RGB").save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            return output.getvalue(), "upload.jpg", "image/jpeg"
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Could not preprocess image, uploading original bytes: {e}")
+        return image_bytes, "upload", "application/octet-stream"
+
+def upload_image_to_freeimage(image_bytes: bytes, max_edge: int = DEFAULT_MAX_EDGE):
     """
     Uploads an image from bytes to freeimage.host and returns the direct URL.
-    This uses the public API key provided.
+    The image is preprocessed and sent as a multipart file; re-uploading the same bytes returns the cached URL.
     """
-    FREEIMAGE_API_URL = "https://freeimage.host/api/1/upload"
-    API_KEY = "6d207e02198a847aa98d0a2a901485a5"
+    API_KEY = os.getenv("FREEIMAGE_API_KEY", "6d207e02198a847aa98d0a2a901485a5")
+
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    with _upload_cache_lock:
+        cached_url = _upload_cache.get(content_hash)
+        if cached_url:
+            _upload_cache.move_to_end(content_hash)
+            print(f"Reusing previous upload for identical image: {cached_url}")
+            return cached_url
 
     try:
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        upload_bytes, filename, mime_type = preprocess_image(image_bytes, max_edge)
+        print(f"Uploading {len(upload_bytes)} bytes (original {len(image_bytes)} bytes)")
 
         payload = {
             'key': API_KEY,
             'action': 'upload',
-            'source': base64_image,
             'format': 'json'
         }
+        files = {'source': (filename, upload_bytes, mime_type)}
 
-        response = requests.post(FREEIMAGE_API_URL, data=payload, timeout=30)
+        response = requests.post(FREEIMAGE_API_URL, data=payload, files=files, timeout=30)
         response.raise_for_status()
 
         result = response.json()
@@ -27,6 +70,10 @@ def upload_image_to_freeimage(image_bytes: bytes):
         if result.get("status_code") == 200 and result.get("image"):
             image_url = result["image"]["url"]
             print(f"Image uploaded successfully to freeimage.host: {image_url}")
+            with _upload_cache_lock:
+                _upload_cache[content_hash] = image_url
+                while len(_upload_cache) > UPLOAD_CACHE_MAX_ENTRIES:
+                    _upload_cache.popitem(last=False)
             return image_url
         else:
             error_message = result.get("status_txt", "Unknown error from freeimage.host API.")
@@ -38,4 +85,4 @@ def upload_image_to_freeimage(image_bytes: bytes):
         return None
     except Exception as e:
         print(f"An unexpected error occurred during image upload: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,75 @@
+import os
+import re
+import threading
+from collections import Counter
+
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.85"))
+EXACT_MATCH_CONFIDENCE = 1.0
+FILLER_MATCH_CONFIDENCE = 0.9
+
+# Whole-message phrases only: anything with extra content (an address, a price, "now I need a
+# business card") is left to Gemini.
+_PHRASES = {
+    "GREETING": {"hi", "hello", "hey", "hi there", "hello there", "hey there", "good morning", "good afternoon", "good evening"},
+    "THANKS": {"thanks", "thank you", "thank you so much", "thanks a lot", "thx"},
+    "RESET": {"start over", "lets start over", "reset", "start fresh", "new design", "start a new design", "clear everything", "clear it"},
+    "GENERATE": {
+        "show me", "show it", "show it to me", "show me the image", "show me the design", "show me what it looks like",
+        "generate", "generate it", "generate the image", "make the image", "make it", "create it", "render it",
+        "lets see", "lets see it", "lets see what it looks like", "im ready", "i am ready", "show it again", "show me again",
+    },
+}
+_LEADING_FILLERS = re.compile(r"^(ok|okay|great|perfect|cool|awesome|nice|yes|yeah|sure|alright|looks good|sounds good|that looks good|please)\s+")
+_TRAILING_FILLERS = re.compile(r"\s+(please|now|then|thanks|thank you)$")
+
+_RESPONSES = {
+    "GREETING": "Hello! Tell me what you'd like to create, for example a 'Just Listed' flyer for 123 Main St.",
+    "THANKS": "You're welcome! Let me know if you'd like to change anything or start another design.",
+    "RESET": "You got it! Starting a new design. What are we creating this time?",
+    "GENERATE": "Of course! Generating your image now...",
+}
+_ACTIONS = {"GREETING": "CONVERSE", "THANKS": "CONVERSE", "RESET": "RESET", "GENERATE": "GENERATE"}
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _normalize(message: str):
+    text = re.sub(r"[^a-z0-9\s]", "", (message or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+def classify_intent(message: str, design_context: dict):
+    """Returns (intent, confidence) for a message, or (None, 0.0) when no local rule applies."""
+    text = _normalize(message)
+    confidence = EXACT_MATCH_CONFIDENCE
+    for _ in range(2):
+        for intent, phrases in _PHRASES.items():
+            if text in phrases:
+                if intent == "GENERATE" and not design_context.get("template_uid"):
+                    return None, 0.0
+                return intent, confidence
+        stripped = _TRAILING_FILLERS.sub("", _LEADING_FILLERS.sub("", text))
+        if stripped == text:
+            break
+        text, confidence = stripped, FILLER_MATCH_CONFIDENCE
+    return None, 0.0
+
+def route_message(message: str, design_context: dict, threshold: float = ROUTER_CONFIDENCE_THRESHOLD):
+    """
+    Fast path in front of Gemini. Returns a `handle_ai_decision` payload for obvious greetings,
+    resets and generate requests, or None when the model should decide.
+    """
+    intent, confidence = classify_intent(message, design_context)
+    with _stats_lock:
+        if intent and confidence >= threshold:
+            _stats["handled"] += 1
+            _stats[f"handled_{intent.lower()}"] += 1
+        else:
+            _stats["fallback"] += 1
+    if not intent or confidence < threshold:
+        return None
+    return {"action": _ACTIONS[intent], "response_text": _RESPONSES[intent], "routed_locally": True}
+
+def router_stats():
+    """Snapshot of how many turns the router handled locally (overall and per intent) versus sent to Gemini."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,39 @@
+import os
+
+import streamlit as st
+from dotenv import load_dotenv
+
+from telemetry import failure_counts, gauges, stage_percentiles
+
+load_dotenv()
+st.set_page_config(page_title="ROA AI Designer - Metrics", layout="wide")
+st.title("Latency Metrics")
+
+if os.getenv("ADMIN_PAGE_ENABLED", "").lower() not in ("1", "true", "yes"):
+    st.info("The metrics page is disabled. Set ADMIN_PAGE_ENABLED=1 to turn it on.")
+    st.stop()
+
+st.caption("Per-stage latency over the most recent samples in this process. Full traces are written to the JSONL trace log.")
+
+percentiles = stage_percentiles()
+if not percentiles:
+    st.write("No chat turns or renders have been recorded yet.")
+else:
+    st.dataframe(
+        [
+            {"stage": stage, "count": stats["count"], "p50 (ms)": round(stats["p50"] * 1000, 1), "p95 (ms)": round(stats["p95"] * 1000, 1)}
+            for stage, stats in sorted(percentiles.items())
+        ],
+        use_container_width=True,
+    )
+
+failures = failure_counts()
+if failures:
+    st.subheader("Failures")
+    st.dataframe([{"stage": stage, "reason": reason, "count": count} for (stage, reason), count in sorted(failures.items())], use_container_width=True)
+
+st.subheader("Counters")
+st.json(gauges())
+
+if st.button("Refresh"):
+    st.rerun()
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "512"))
+RENDER_CACHE_TTL_SECONDS = float(os.getenv("RENDER_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def render_key(template_uid: str, modifications: list, template_version=None):
+    """
+    Content address of a render: a SHA-256 over the template UID, its version (Bannerbear's
+    updated_at) and the modifications, sorted by layer name with empty fields dropped, so
+    equivalent contexts share one key and an edited template never serves its old renders.
+    """
+    canonical_mods = sorted(
+        ({k: v for k, v in mod.items() if v is not None} for mod in modifications or []),
+        key=lambda mod: mod.get("name", ""),
+    )
+    payload = json.dumps({"template": template_uid, "version": template_version, "modifications": canonical_mods},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RenderCache:
+    """Thread-safe LRU of render key -> image URL, bounded by entry count and TTL."""
+
+    def __init__(self, max_entries: int = RENDER_CACHE_MAX_ENTRIES, ttl_seconds: float = RENDER_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stored_at, image_url)
+        self._lock = threading.Lock()
+
+    def get(self, template_uid: str, modifications: list, template_version=None):
+        key = render_key(template_uid, modifications, template_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, template_uid: str, modifications: list, image_url: str, template_version=None):
+        key = render_key(template_uid, modifications, template_version)
+        with self._lock:
+            self._entries[key] = (time.time(), image_url)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,170 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bannerbear_helpers import create_image, poll_for_image
+from telemetry import start_trace
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "8"))
+RENDER_JOBS_PER_SESSION = int(os.getenv("RENDER_JOBS_PER_SESSION", "2"))
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "100"))
+FINISHED_JOB_RETENTION_SECONDS = 3600
+
+FINISHED_STATUSES = {"completed", "failed", "timed_out", "cancelled", "rejected"}
+
+class RenderJob:
+    """One queued Bannerbear render. `status` moves from queued -> running -> one of FINISHED_STATUSES."""
+
+    def __init__(self, job_id: str, session_id: str, template_uid: str, modifications: list, template_version=None):
+        self.id = job_id
+        self.session_id = session_id
+        self.template_uid = template_uid
+        self.modifications = modifications
+        self.template_version = template_version
+        self.status = "queued"
+        self.image_url = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    def _finish(self, status: str, image_url: str = None, error: str = None):
+        self.status, self.image_url, self.error = status, image_url, error
+        self.finished_at = time.time()
+
+class RenderQueue:
+    """
+    Process-wide render queue. Renders run on a bounded worker pool so Streamlit script threads
+    never block on Bannerbear. A new submission supersedes (cancels) the session's previous job,
+    and each session may occupy at most `max_jobs_per_session` workers at a time: further jobs of
+    the session stay "queued" and start as its earlier ones finish.
+    """
+
+    def __init__(self, api_key: str, max_workers: int = RENDER_WORKERS, max_jobs_per_session: int = RENDER_JOBS_PER_SESSION,
+                 max_queued: int = RENDER_QUEUE_MAX, render_cache=None):
+        self.api_key = api_key
+        self.max_jobs_per_session = max_jobs_per_session
+        self.max_queued = max_queued
+        self.render_cache = render_cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._jobs = {}
+        self._waiting = {}  # session_id -> deque of jobs held back by the per-session limit
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, template_uid: str, modifications: list, template_version=None):
+        """
+        Queues a render for a session, cancelling any earlier job of that session.
+        Returns the RenderJob; its status is "rejected" (with `error` set) if the queue is full.
+        """
+        return self.submit_many(session_id, [(template_uid, modifications, template_version)])[0]
+
+    def submit_many(self, session_id: str, renders: list):
+        """
+        Queues several (template_uid, modifications, template_version) renders as one request, e.g. style variants.
+        Earlier jobs of the session are superseded as in `submit`. Up to `max_jobs_per_session` of
+        them start at once and the rest wait for a slot. Returns one RenderJob per render, in order.
+        """
+        jobs = [RenderJob(f"render-{next(self._ids)}", session_id, uid, [dict(m) for m in mods], version) for uid, mods, version in renders]
+        with self._lock:
+            self._prune()
+            self._cancel_session_jobs(session_id)
+            pending = sum(1 for j in self._jobs.values() if not j.done)
+            for job in jobs:
+                if pending + len(jobs) > self.max_queued:
+                    job._finish("rejected", error="The render queue is full.")
+                else:
+                    self._waiting.setdefault(session_id, deque()).append(job)
+                self._jobs[job.id] = job
+        self._start_waiting(session_id)
+        return jobs
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def cancel_session(self, session_id: str):
+        with self._lock:
+            self._cancel_session_jobs(session_id)
+
+    def _cancel_session_jobs(self, session_id: str):
+        for job in self._jobs.values():
+            if job.session_id == session_id and not job.done:
+                job.cancel_event.set()
+                if job.status == "queued":
+                    job._finish("cancelled")
+
+    def _occupied(self, session_id: str):
+        """
+        Workers the session holds: its dispatched, unfinished jobs. Superseded jobs may still be inside
+        create_image, which cannot be interrupted; they are on their way out and are not counted.
+        """
+        waiting = self._waiting.get(session_id, ())
+        return sum(1 for j in self._jobs.values()
+                   if j.session_id == session_id and not j.done and not j.cancel_event.is_set() and j not in waiting)
+
+    def _start_waiting(self, session_id: str):
+        """Dispatches the session's waiting jobs while it has free slots."""
+        to_start = []
+        with self._lock:
+            waiting = self._waiting.get(session_id)
+            while waiting and self._occupied(session_id) < self.max_jobs_per_session:
+                job = waiting.popleft()
+                if not job.done:
+                    to_start.append(job)
+            if not waiting:
+                self._waiting.pop(session_id, None)
+        for job in to_start:
+            self._pool.submit(self._run, job)
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: RenderJob):
+        if job.done:
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        trace = start_trace("render", job_id=job.id, session_id=job.session_id, template_uid=job.template_uid)
+        trace.record("render_queue_wait", job.started_at - job.submitted_at)
+        try:
+            with trace.span("render_create") as span:
+                initial_response = create_image(self.api_key, job.template_uid, job.modifications)
+                if not initial_response:
+                    span["error"] = "create_failed"
+            if not initial_response:
+                job._finish("failed", error="Failed to start image generation.")
+                return
+            on_poll = lambda seconds, status, source: trace.record("render_poll", seconds, status=status, source=source)
+            with trace.span("render_wait"):
+                final_image = poll_for_image(self.api_key, initial_response, cancel_event=job.cancel_event, on_poll=on_poll)
+            if final_image and final_image.get("image_url_png"):
+                if self.render_cache is not None:
+                    self.render_cache.put(job.template_uid, job.modifications, final_image["image_url_png"], job.template_version)
+                job._finish("completed", image_url=final_image["image_url_png"])
+            elif final_image and final_image.get("status") in ("timed_out", "cancelled"):
+                job._finish(final_image["status"])
+            else:
+                job._finish("failed", error="Image generation failed during rendering.")
+        except Exception as e:
+            print(f"Render job {job.id} crashed: {e}")
+            job._finish("failed", error="Image generation failed unexpectedly.")
+        finally:
+            failed = job.status in ("failed", "timed_out")
+            trace.finish(status=job.status, error=(job.error or job.status) if failed else None,
+                         polls=sum(1 for span in trace.spans if span["stage"] == "render_poll"))
+            self._start_waiting(job.session_id)
+
+    def depth(self):
+        """Number of jobs that are queued or running."""
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if not j.done)
@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")  # off unless configured, e.g. TRACE_LOG_PATH=traces.jsonl
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "3"))
+STAGE_SAMPLE_WINDOW = int(os.getenv("TELEMETRY_SAMPLE_WINDOW", "1000"))
+METRIC_PREFIX = "roa"
+SESSION_SIZE_TTL_SECONDS = 3600
+
+_durations = {}  # stage -> deque of recent durations in seconds
+_totals = Counter()  # (stage, "count" | "sum") -> running totals since start
+_failures = Counter()  # (stage, reason) -> count
+_gauges = {}  # name -> callable returning a number or a {label: number} dict
+_session_sizes = {}  # session id -> (approximate state bytes, last seen)
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+def observe(stage: str, seconds: float):
+    """Records one duration sample for a stage."""
+    with _lock:
+        _durations.setdefault(stage, deque(maxlen=STAGE_SAMPLE_WINDOW)).append(seconds)
+        _totals[(stage, "count")] += 1
+        _totals[(stage, "sum")] += seconds
+
+def process_uptime():
+    """Seconds since this process started, read from /proc (Linux); None where that is not available."""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as f:
+            stat = f.read()
+        with open("/proc/uptime", encoding="ascii") as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(stat.rsplit(")", 1)[1].split()[19])  # field 22, counted after the command name
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def record_failure(stage: str, reason: str):
+    with _lock:
+        _failures[(stage, reason)] += 1
+
+def register_gauge(name: str, read):
+    """Exposes an externally owned value (e.g. cache hits) on the metrics endpoint and admin page."""
+    _gauges[name] = read
+
+def gauges():
+    values = {}
+    for name, read in list(_gauges.items()):
+        try:
+            values[name] = read()
+        except Exception as e:
+            print(f"Could not read gauge {name}: {e}")
+    return values
+
+def _percentile(sorted_values: list, fraction: float):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def stage_percentiles():
+    """{stage: {"count", "p50", "p95"}} over the most recent samples of each stage."""
+    with _lock:
+        samples = {stage: sorted(values) for stage, values in _durations.items() if values}
+        counts = {stage: _totals[(stage, "count")] for stage in samples}
+    return {stage: {"count": counts[stage], "p50": _percentile(v, 0.5), "p95": _percentile(v, 0.95)} for stage, v in samples.items()}
+
+def failure_counts():
+    with _lock:
+        return dict(_failures)
+
+def approx_size(obj, _seen=None):
+    """Approximate deep size in bytes of plain data (containers, strings, objects' attributes), counting each object once."""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key, seen) + approx_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(approx_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += approx_size(vars(obj), seen)
+    return size
+
+def record_session_size(session_id: str, size_bytes: int):
+    """Remembers the latest state size of a session; sessions not seen for SESSION_SIZE_TTL_SECONDS drop out."""
+    now = time.time()
+    with _lock:
+        _session_sizes[session_id] = (size_bytes, now)
+        for stale in [sid for sid, (_, seen) in _session_sizes.items() if now - seen > SESSION_SIZE_TTL_SECONDS]:
+            del _session_sizes[stale]
+
+def session_size_stats():
+    """{"sessions", "avg_bytes", "max_bytes", "total_bytes"} over the recently active sessions."""
+    with _lock:
+        sizes = [size for size, _ in _session_sizes.values()]
+    return {
+        "sessions": len(sizes),
+        "avg_bytes": sum(sizes) // len(sizes) if sizes else 0,
+        "max_bytes": max(sizes, default=0),
+        "total_bytes": sum(sizes),
+    }
+
+class Trace:
+    """
+    Timing record for one unit of work (a chat turn or a background render). Spans are timed
+    stages with attributes; `finish` adds the total span and appends the trace to the JSONL log.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._finished = False
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        """Times a block. The yielded dict can be filled with attributes (sizes, token counts, errors) inside the block."""
+        span_attrs = dict(attrs)
+        start = time.perf_counter()
+        try:
+            yield span_attrs
+        except Exception as e:
+            span_attrs.setdefault("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **span_attrs)
+
+    def record(self, stage: str, seconds: float, **attrs):
+        """Adds a span measured elsewhere, e.g. the time a render waited in the queue."""
+        self.spans.append({"stage": stage, "duration_ms": round(seconds * 1000, 2), **attrs})
+        observe(stage, seconds)
+        if attrs.get("error"):
+            record_failure(stage, str(attrs["error"]))
+
+    def finish(self, **attrs):
+        if self._finished:
+            return
+        self._finished = True
+        self.attrs.update(attrs)
+        total = time.perf_counter() - self._start
+        observe(f"{self.name}_total", total)
+        if self.attrs.get("error"):
+            record_failure(f"{self.name}_total", str(self.attrs["error"]))
+        _write_trace({
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(total * 1000, 2),
+            **self.attrs,
+            "spans": self.spans,
+        })
+
+def start_trace(name: str, **attrs):
+    return Trace(name, **attrs)
+
+def _write_trace(record: dict):
+    if not TRACE_LOG_PATH:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        try:
+            if os.path.exists(TRACE_LOG_PATH) and os.path.getsize(TRACE_LOG_PATH) + len(line) + 1 > TRACE_LOG_MAX_BYTES:
+                _rotate_trace_log()
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Could not write trace log {TRACE_LOG_PATH}: {e}")
+
+def _rotate_trace_log():
+    """Shifts traces.jsonl -> traces.jsonl.1 -> ... keeping TRACE_LOG_BACKUPS old files, like logging's RotatingFileHandler."""
+    if TRACE_LOG_BACKUPS <= 0:
+        os.remove(TRACE_LOG_PATH)
+        return
+    for number in range(TRACE_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{TRACE_LOG_PATH}.{number}"):
+            os.replace(f"{TRACE_LOG_PATH}.{number}", f"{TRACE_LOG_PATH}.{number + 1}")
+    os.replace(TRACE_LOG_PATH, f"{TRACE_LOG_PATH}.1")
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def prometheus_text():
+    """Renders all metrics in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_duration_seconds Duration of chat-turn and render stages (recent-window quantiles).",
+        f"# TYPE {METRIC_PREFIX}_stage_duration_seconds summary",
+    ]
+    with _lock:
+        totals = dict(_totals)
+    for stage, stats in sorted(stage_percentiles().items()):
+        label = _escape_label(stage)
+        lines.append(f'{METRIC_PREFIX}_stage_duration_seconds{{stage="{label}",quantile="0.5"}} {stats["p50"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_duration_seconds{{stage="{label}",quantile="0.95"}} {stats["p95"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_sum{{stage="{label}"}} {totals[(stage, "sum")]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_duration_seconds_count{{stage="{label}"}} {totals[(stage, "count")]}')
+
+    lines.append(f"# HELP {METRIC_PREFIX}_stage_failures_total Failed stages by reason.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_stage_failures_total counter")
+    for (stage, reason), count in sorted(failure_counts().items()):
+        lines.append(f'{METRIC_PREFIX}_stage_failures_total{{stage="{_escape_label(stage)}",reason="{_escape_label(reason)}"}} {count}')
+
+    for name, value in sorted(gauges().items()):
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        if isinstance(value, dict):
+            for label, item in sorted(value.items()):
+                lines.append(f'{metric}{{key="{_escape_label(label)}"}} {item}')
+        else:
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int):
+    """Serves `prometheus_text()` at http://0.0.0.0:<port>/metrics from a background thread."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on port {port}")
+    return server
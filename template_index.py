@@ -0,0 +1,331 @@
+import difflib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+COMPACT_SEPARATORS = (",", ":")
+TOP_K_TEMPLATES = int(os.getenv("TEMPLATE_TOP_K", "5"))
+NAME_WEIGHT = 2
+REMAP_CUTOFF = 0.6
+# Words that only say what kind of layer it is; two layer names sharing just one of these mean different things.
+_GENERIC_LAYER_WORDS = {"photo", "image", "img", "picture", "pic", "name", "text", "title", "label", "line", "layer"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_URL_RE = re.compile(r"^https?://\S+$")
+_STOPWORDS = {"a", "an", "the", "and", "or", "for", "of", "to", "in", "on", "at", "with", "my", "me", "i", "is", "it", "this", "that", "please", "can", "you", "some", "new"}
+_NEW_DESIGN_RE = re.compile(
+    r"\b(different|another|other|new)\s+(style|template|layout|design|look|one|version)"
+    r"|\b(don'?t|do not)\s+like\b|\binstead\b|\bstart\s+over\b|\bswitch\b"
+    r"|\b(make|create|design|need|want|do)\s+(me\s+)?(a|an|some)\b",
+    re.IGNORECASE,
+)
+
+def estimate_tokens(text: str):
+    """Cheap local token estimate (~4 characters per token for English/JSON), good enough to compare prompt sizes."""
+    return (len(text) + 3) // 4
+
+def template_fingerprint(template: dict):
+    """Identifies one version of a template: Bannerbear's updated_at, falling back to a hash of the payload."""
+    return template.get("updated_at") or hash(json.dumps(template, sort_keys=True))
+
+def layer_type(modification: dict):
+    """Infers a layer's type from the keys Bannerbear lists in `available_modifications`."""
+    if "image_url" in modification:
+        return "image"
+    if "text" in modification:
+        return "text"
+    other_keys = [k for k in modification if k != "name"]
+    return other_keys[0] if other_keys else "other"
+
+def modifiable_layers(template: dict):
+    """Returns {layer_name: layer_type} for every layer the template lets us modify."""
+    return {m["name"]: layer_type(m) for m in template.get("available_modifications") or [] if m.get("name")}
+
+def digest_entry(template: dict):
+    """The compact form of a template sent to Gemini: uid, name and modifiable layers only."""
+    return {"uid": template.get("uid"), "name": template.get("name"), "layers": modifiable_layers(template)}
+
+class TemplateDigest:
+    """
+    Precomputed compact digest of the template catalog for the Gemini prompt.
+    `sync` only recomputes entries for templates whose fingerprint changed.
+    """
+
+    def __init__(self):
+        self._entries = {}  # uid -> (fingerprint, entry)
+        self._synced_catalog = None
+        self._rendered = ""
+        self._lock = threading.Lock()
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def sync(self, templates: list):
+        """Brings the digest in line with the catalog. A no-op when called again with the same catalog list."""
+        with self._lock:
+            if templates is self._synced_catalog:
+                return
+            entries = {}
+            for template in templates:
+                uid = template.get("uid")
+                fingerprint = template_fingerprint(template)
+                cached = self._entries.get(uid)
+                entries[uid] = cached if cached and cached[0] == fingerprint else (fingerprint, digest_entry(template))
+            self._entries = entries
+            self._rendered = json.dumps([entry for _, entry in entries.values()], separators=COMPACT_SEPARATORS)
+            self._synced_catalog = templates
+
+            self.tokens_before = estimate_tokens(json.dumps(templates, indent=2))
+            self.tokens_after = estimate_tokens(self._rendered)
+            print(f"Template digest rebuilt for {len(entries)} templates: ~{self.tokens_before} -> ~{self.tokens_after} tokens")
+
+    def render(self, template_uids: list = None):
+        """Returns the digest as compact JSON: the whole catalog, or only `template_uids` in the given order."""
+        if template_uids is None:
+            return self._rendered
+        entries = self._entries
+        return json.dumps([entries[uid][1] for uid in template_uids if uid in entries], separators=COMPACT_SEPARATORS)
+
+def tokenize(text: str):
+    """Lowercases and splits on anything that is not a letter or digit, so `agent_photo` and `AgentPhoto 2` both yield searchable terms."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "").lower()
+    return [t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS]
+
+def template_terms(template: dict):
+    """Term frequencies for one template: name terms count NAME_WEIGHT times, layer-name terms once."""
+    terms = Counter()
+    for term in tokenize(template.get("name", "")):
+        terms[term] += NAME_WEIGHT
+    for layer_name in modifiable_layers(template):
+        terms.update(tokenize(layer_name))
+    return terms
+
+class TemplateRetrievalIndex:
+    """
+    Local TF-IDF index over template names and layer names, used to send Gemini only the
+    templates relevant to a message. `sync` updates postings only for templates that changed.
+    """
+
+    def __init__(self):
+        self._docs = {}  # uid -> (fingerprint, Counter of terms, norm)
+        self._postings = {}  # term -> {uid: tf}
+        self._names = {}  # uid -> template name
+        self._synced_catalog = None
+        self._lock = threading.Lock()
+
+    def sync(self, templates: list):
+        with self._lock:
+            if templates is self._synced_catalog:
+                return
+            live = {}
+            for template in templates:
+                uid = template.get("uid")
+                live[uid] = template
+                fingerprint = template_fingerprint(template)
+                doc = self._docs.get(uid)
+                if doc and doc[0] == fingerprint:
+                    continue
+                if doc:
+                    self._remove(uid)
+                terms = template_terms(template)
+                self._names[uid] = template.get("name", "")
+                self._docs[uid] = (fingerprint, terms, math.sqrt(sum(tf * tf for tf in terms.values())) or 1.0)
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[uid] = tf
+            for uid in [uid for uid in self._docs if uid not in live]:
+                self._remove(uid)
+            self._synced_catalog = templates
+
+    def _remove(self, uid):
+        _, terms, _ = self._docs.pop(uid)
+        self._names.pop(uid, None)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting:
+                posting.pop(uid, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int = TOP_K_TEMPLATES, exclude: set = ()):
+        """Returns up to k (uid, score) pairs with a positive score, best first."""
+        with self._lock:
+            n_docs = len(self._docs)
+            scores = Counter()
+            for term, q_tf in Counter(tokenize(query)).items():
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + n_docs / len(posting))
+                for uid, tf in posting.items():
+                    scores[uid] += q_tf * tf * idf * idf
+            ranked = [(uid, score / self._docs[uid][2]) for uid, score in scores.items() if uid not in exclude]
+        ranked.sort(key=lambda pair: pair[1], reverse=True)
+        return ranked[:k]
+
+    def name_of(self, template_uid: str):
+        return self._names.get(template_uid, "")
+
+    def named_in(self, query: str, current_uid: str):
+        """
+        UIDs of other templates whose name shares a term with `query` that the current template's name
+        and layers lack, e.g. "try the modern one" while editing the "Just Sold Flyer".
+        """
+        with self._lock:
+            doc = self._docs.get(current_uid)
+            terms = set(tokenize(query)) - (set(doc[1]) if doc else set())
+            return {uid for uid, name in self._names.items() if uid != current_uid and terms & set(tokenize(name))}
+
+def normalize_layer_name(name: str):
+    """Case- and separator-insensitive form of a layer name: "Agent Name", "agent-name" and "agent_name" are all "agentname"."""
+    return re.sub(r"[^a-z0-9]", "", (name or "").lower())
+
+class LayerIndex:
+    """
+    Per-template layer lookup tables used to check modifications before anything is rendered:
+    uid -> ({layer_name: layer_type}, {normalized_name: layer_name}). `sync` only rebuilds changed templates.
+    """
+
+    def __init__(self):
+        self._templates = {}  # uid -> (fingerprint, layers, by_normalized_name)
+        self._synced_catalog = None
+        self._lock = threading.Lock()
+
+    def sync(self, templates: list):
+        with self._lock:
+            if templates is self._synced_catalog:
+                return
+            entries = {}
+            for template in templates:
+                uid = template.get("uid")
+                fingerprint = template_fingerprint(template)
+                cached = self._templates.get(uid)
+                if cached and cached[0] == fingerprint:
+                    entries[uid] = cached
+                else:
+                    layers = modifiable_layers(template)
+                    entries[uid] = (fingerprint, layers, {normalize_layer_name(name): name for name in layers})
+            self._templates = entries
+            self._synced_catalog = templates
+
+    def layers(self, template_uid: str):
+        """{layer_name: layer_type} for a template, or None if it is not in the catalog."""
+        entry = self._templates.get(template_uid)
+        return entry[1] if entry else None
+
+    def version(self, template_uid: str):
+        """The template's fingerprint (its updated_at), or None if it is not in the catalog."""
+        entry = self._templates.get(template_uid)
+        return entry[0] if entry else None
+
+    def validate(self, template_uid: str, modifications: list):
+        """
+        Checks modifications against a template's layers. Returns (valid, problems): `valid` holds the
+        usable modifications with layer names normalized to the template's own (e.g. "Agent Name" ->
+        "agent_name"), a URL given as text on an image layer moved to `image_url`, and at most one
+        modification per layer (the last wins). `problems` lists a short reason for each one dropped.
+        """
+        entry = self._templates.get(template_uid)
+        if template_uid is None:
+            return [], ["no template has been chosen yet"]
+        if entry is None:
+            return [], [f"template `{template_uid}` is not in the catalog"]
+        _, layers, by_normalized = entry
+        valid, problems = {}, []
+        for mod in modifications:
+            name = mod.get("name") or ""
+            layer = name if name in layers else by_normalized.get(normalize_layer_name(name))
+            if layer is None:
+                problems.append(f"`{name}` is not a layer of this template")
+                continue
+            values = {key: value for key, value in mod.items() if key != "name" and value is not None}
+            if layers[layer] == "image":
+                if "image_url" not in values and _URL_RE.match(str(values.get("text", ""))):
+                    values["image_url"] = values.pop("text")
+                if not values.get("image_url"):
+                    problems.append(f"`{layer}` is an image layer and needs an uploaded image")
+                    continue
+                values.pop("text", None)
+            elif "image_url" in values:
+                if "text" not in values:
+                    problems.append(f"`{layer}` is a text layer and can't show an image")
+                    continue
+                del values["image_url"]
+            if values:
+                valid[layer] = {"name": layer, **values}
+        return list(valid.values()), problems
+
+    def remap(self, from_uid: str, to_uid: str, modifications: list):
+        """
+        Moves modifications onto another template's layers of the same type: exact name first, then
+        normalized name, then the closest name (difflib) among layers sharing a word other than a generic
+        one like "photo" or "name", so `agent_photo` never lands on `property_photo`.
+        Returns (remapped, dropped_layer_names, renamed) where renamed lists (old_name, new_name) pairs.
+        """
+        target = self._templates.get(to_uid)
+        if target is None:
+            return [], [mod["name"] for mod in modifications], []
+        _, layers, by_normalized = target
+        source_layers = self.layers(from_uid) or {}
+        kind_of = lambda mod: source_layers.get(mod["name"]) or ("image" if mod.get("image_url") else "text")
+        distinctive = lambda name: set(tokenize(name)) - _GENERIC_LAYER_WORDS
+
+        placed, used = {}, set()
+        for position, mod in enumerate(modifications):
+            layer = mod["name"] if mod["name"] in layers else by_normalized.get(normalize_layer_name(mod["name"]))
+            if layer and layers[layer] == kind_of(mod) and layer not in used:
+                placed[position] = layer
+                used.add(layer)
+        for position, mod in enumerate(modifications):
+            if position in placed:
+                continue
+            words = distinctive(mod["name"])
+            candidates = {normalized: name for normalized, name in by_normalized.items()
+                          if layers[name] == kind_of(mod) and name not in used and words & distinctive(name)}
+            match = difflib.get_close_matches(normalize_layer_name(mod["name"]), list(candidates), n=1, cutoff=REMAP_CUTOFF)
+            if match:
+                placed[position] = candidates[match[0]]
+                used.add(placed[position])
+
+        remapped = [{**mod, "name": placed[position]} for position, mod in enumerate(modifications) if position in placed]
+        dropped = [mod["name"] for position, mod in enumerate(modifications) if position not in placed]
+        renamed = [(mod["name"], placed[position]) for position, mod in enumerate(modifications)
+                   if position in placed and normalize_layer_name(mod["name"]) != normalize_layer_name(placed[position])]
+        return remapped, dropped, renamed
+
+def find_compatible_templates(templates: list, modifications: list, exclude: set = ()):
+    """Templates whose modifiable layers include every layer named in `modifications`, so the design carries over intact."""
+    needed = {mod["name"] for mod in modifications}
+    return [t for t in templates if t.get("uid") not in exclude and needed <= modifiable_layers(t).keys()]
+
+def max_image_layer_size(templates: list, default: int = 2048):
+    """Longest edge any image layer can need: the largest dimension among templates that have an image layer."""
+    sizes = [max(t.get("width") or 0, t.get("height") or 0) for t in templates if "image" in modifiable_layers(t).values()]
+    return max(sizes, default=0) or default
+
+def is_new_design_request(message: str):
+    """True when a message starts a design or asks for a different style, i.e. when template selection is needed."""
+    return bool(_NEW_DESIGN_RE.search(message or ""))
+
+def select_prompt_templates(index: TemplateRetrievalIndex, message: str, design_context: dict, k: int = TOP_K_TEMPLATES):
+    """
+    Chooses which templates go into the Gemini prompt for this turn.
+    Refinements of an in-progress design get only the current template, unless the message names
+    another template ("use the open house one"), in which case the current template and the top-k
+    matches for the message are sent. New designs and style changes get the top-k matches (a style
+    change is ranked against the current template's name too, so alternatives serve the same
+    purpose). Returns None (send the whole catalog) when nothing matches.
+    """
+    current_uid = design_context.get("template_uid")
+    if current_uid and not is_new_design_request(message):
+        ranked = index.search(message, k, exclude={current_uid})
+        named = index.named_in(message, current_uid)
+        if not any(uid in named for uid, _ in ranked):
+            return [current_uid]
+        return [current_uid] + [uid for uid, _ in ranked]
+    query = f"{message} {index.name_of(current_uid)}" if current_uid else message
+    ranked = index.search(query, k, exclude={current_uid} if current_uid else ())
+    if not ranked:
+        return None
+    return ([current_uid] if current_uid else []) + [uid for uid, _ in ranked]
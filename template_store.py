@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+
+from bannerbear_helpers import fetch_template_summaries, fetch_template_details, get_template_details
+
+CACHE_PATH = os.getenv("TEMPLATE_CACHE_PATH", ".template_cache.json")
+REVALIDATE_SECONDS = float(os.getenv("TEMPLATE_REVALIDATE_SECONDS", "600"))
+CACHE_FORMAT_VERSION = 1
+
+def _summary_stamp(summary: dict):
+    """The validator used to decide whether a template changed: Bannerbear's updated_at, or an ETag if one is present."""
+    return summary.get("updated_at") or summary.get("etag")
+
+class TemplateStore:
+    """
+    Disk-backed template catalog. Starts instantly from the last saved snapshot and
+    revalidates against Bannerbear in the background, refetching only templates whose
+    `updated_at` changed. `version` increments whenever the catalog contents change.
+    With autoload=False the store only reads the saved snapshot and never revalidates on its own,
+    for callers that just `get` a few templates (e.g. the batch CLI).
+    """
+
+    def __init__(self, api_key: str, path: str = CACHE_PATH, revalidate_seconds: float = REVALIDATE_SECONDS, autoload: bool = True):
+        self.api_key = api_key
+        self.path = path
+        self.revalidate_seconds = revalidate_seconds
+        self.version = 0
+        self.last_validated = 0.0
+        self._entries = {}  # uid -> {"stamp": ..., "details": {...}}
+        self._list_etag = None
+        self._snapshot = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        if not autoload:
+            self._load_from_disk()
+        elif self._load_from_disk():
+            self.refresh(background=True)
+        else:
+            self.refresh(background=False)
+
+    def templates(self):
+        """
+        Returns the current catalog as a tuple shared by every caller (treat it as read-only), kicking
+        off a background revalidation when it is stale. A changed catalog is a new tuple.
+        """
+        if time.time() - self.last_validated > self.revalidate_seconds:
+            self.refresh(background=True)
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = tuple(entry["details"] for entry in self._entries.values())
+            return self._snapshot
+
+    def get(self, template_uid: str):
+        """Returns one template's details, fetching and caching it if the store has not seen it yet."""
+        with self._lock:
+            entry = self._entries.get(template_uid)
+        if entry:
+            return entry["details"]
+        details = get_template_details(self.api_key, template_uid)
+        if details:
+            self._apply({template_uid: {"stamp": details.get("updated_at"), "details": details}}, removed=())
+            self._save_to_disk()
+        return details
+
+    def refresh(self, background: bool = True, force: bool = False):
+        """
+        Revalidates the catalog against Bannerbear. With force=True every template is refetched.
+        Returns immediately when background=True; only one revalidation runs at a time, and no new
+        background thread is started while one is still running.
+        """
+        if background:
+            with self._lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            threading.Thread(target=self._revalidate_in_background, args=(force,), name="template-revalidate", daemon=True).start()
+        else:
+            self._revalidate(force)
+
+    def _revalidate_in_background(self, force: bool):
+        try:
+            self._revalidate(force)
+        finally:
+            self._refreshing = False
+
+    def _revalidate(self, force: bool):
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            start = time.perf_counter()
+            summaries, etag = fetch_template_summaries(self.api_key, None if force else self._list_etag)
+            self.last_validated = time.time()
+            if summaries is None:
+                return
+
+            with self._lock:
+                known = {uid: entry["stamp"] for uid, entry in self._entries.items()}
+            live = {s['uid']: _summary_stamp(s) for s in summaries if s and s.get('uid')}
+            changed = [uid for uid, stamp in live.items() if force or stamp is None or known.get(uid) != stamp]
+            removed = [uid for uid in known if uid not in live]
+
+            fetched = fetch_template_details(self.api_key, changed)
+            updates = {uid: {"stamp": live[uid], "details": details} for uid, details in fetched.items()}
+            self._list_etag = etag if len(fetched) == len(changed) else None
+            if updates or removed:
+                self._apply(updates, removed, order=list(live))
+            self._save_to_disk()
+            print(f"Template store revalidated in {time.perf_counter() - start:.2f}s: "
+                  f"{len(updates)} updated, {len(removed)} removed, {len(live) - len(changed)} unchanged")
+        finally:
+            self._refresh_lock.release()
+
+    def _apply(self, updates: dict, removed, order: list = None):
+        with self._lock:
+            entries = dict(self._entries)
+            entries.update(updates)
+            for uid in removed:
+                entries.pop(uid, None)
+            if order:
+                entries = {uid: entries[uid] for uid in order if uid in entries} | {uid: e for uid, e in entries.items() if uid not in order}
+            self._entries = entries
+            self._snapshot = None
+            self.version += 1
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable template cache {self.path}: {e}")
+            return False
+        if data.get("format") != CACHE_FORMAT_VERSION or not data.get("templates"):
+            return False
+        self._list_etag = data.get("list_etag")
+        self._apply({t["uid"]: {"stamp": t.get("stamp"), "details": t["details"]} for t in data["templates"]}, removed=())
+        print(f"Loaded {len(self._entries)} templates from {self.path}")
+        return True
+
+    def _save_to_disk(self):
+        with self._lock:
+            data = {
+                "format": CACHE_FORMAT_VERSION,
+                "list_etag": self._list_etag,
+                "templates": [{"uid": uid, **entry} for uid, entry in self._entries.items()],
+            }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write template cache {self.path}: {e}")